@@ -6,48 +6,163 @@ import pandas as pd
 import seaborn as sns
 import numpy as np
 import os
+from timeit import default_timer as timer
+from download import DataDownloader, DictColumn, COLUMNS, BATCH_BUDGET
+import memo
+import instrument
 # muzete pridat libovolnou zakladni knihovnu ci knihovnu predstavenou na prednaskach
 # dalsi knihovny pak na dotaz
 
 # Ukol 1: nacteni dat
-def get_dataframe(filename: str, verbose: bool = False) -> pd.DataFrame:
+#columns which are not converted to category by default
+KEEP_COLUMNS = ("region", "p13a", "p13b", "p13c", "p1")
+
+def _report(orig_size: float, df: pd.DataFrame, start: float):
+    """[Prints memory report of loaded DataFrame]"""
+    if orig_size is not None:
+        print("orig_size={:.1f} MB".format(orig_size))
+    print("new_size={:.1f} MB".format(df.memory_usage(deep=True).sum() / 1048576))
+    print("load_time={:.2f} s".format(timer() - start))
+    if instrument.peak_rss() is not None:
+        print("peak_rss={:.1f} MB".format(instrument.peak_rss()))
+
+@instrument.traced("get_dataframe", rows=len)
+def get_dataframe(filename: str, verbose: bool = False, keep: tuple = KEEP_COLUMNS) -> pd.DataFrame:
     """[Gets dataframe from file and converts its types to save memory]
 
     Args:
         filename (str): [file containing data to be converted]
-        verbose (bool, optional): [When True prints size of data before and after conversion]. Defaults to False.
+        verbose (bool, optional): [When True prints size of data before and after conversion, load time and peak memory]. Defaults to False.
+        keep (tuple, optional): [Columns which are not converted to category]. Defaults to KEEP_COLUMNS.
 
     Returns:
         pd.DataFrame: [Data from filename converted to DataFrame]
     """
-    df = pd.read_pickle(filename)
-    df["date"] = df["p2a"].apply(lambda x: x)
-    df1 = pd.DataFrame()
-    for column in df:
-        if column == "region" or column == "p13a" or column == "p13b" or column == "p13c" or column == "p1":
-            df1[column] = df[column]
-        else:
-            df1[column] = df[column].astype("category")
+    start = timer()
+    with instrument.stage("read_pickle", bytes=os.path.getsize(filename)) as stage:
+        df = pd.read_pickle(filename)
+        stage.add(rows=len(df))
+    df["date"] = df["p2a"]
+    orig_size = df.memory_usage(deep=True).sum() / 1048576 if verbose else None
+
+    df1 = convert_dataframe(df, keep)
+    #fingerprint of loaded data, memoized aggregates of this frame are computed again when the file changes
+    memo.bind(df1, memo.file_fingerprint(filename, tuple(keep)))
     if verbose:
-        print("orig_size={:.1f} MB".format(df.memory_usage(deep=True).sum() / 1048576))
-        print("new_size={:.1f} MB".format(df1.memory_usage(deep=True).sum() / 1048576))
+        _report(orig_size, df1, start)
     return df1
 
+def convert_dataframe(df: pd.DataFrame, keep: tuple = KEEP_COLUMNS) -> pd.DataFrame:
+    """[Converts types of already loaded data to save memory, columns of df are moved into the result
+
+    Args:
+        df (pd.DataFrame): [Data loaded from accidents.pkl.gz, it is left empty]
+        keep (tuple, optional): [Columns which are not converted to category]. Defaults to KEEP_COLUMNS.
+
+    Returns:
+        pd.DataFrame: [Converted data with date column copied from p2a]
+    """
+    if "date" not in df.columns:
+        df["date"] = df["p2a"]
+    #every column is converted once and removed from the original frame right away,
+    #so there is never more than one extra column in memory
+    columns = {}
+    with instrument.stage("convert", rows=len(df)):
+        for column in list(df.columns):
+            values = df.pop(column)
+            columns[column] = values if column in keep else values.astype("category")
+        return pd.DataFrame(columns, copy=False)
+
+@instrument.traced("load_dataframe", rows=len)
+def load_dataframe(downloader: DataDownloader = None, regions: list = None, columns: list = None,
+                   verbose: bool = False, keep: tuple = KEEP_COLUMNS) -> pd.DataFrame:
+    """[Builds DataFrame directly from columnar cache of DataDownloader, without converting types afterwards]
+
+    Args:
+        downloader (DataDownloader, optional): [Source of data]. Defaults to DataDownloader with default folders.
+        regions (list, optional): [Regions to load]. Defaults to all regions.
+        columns (list, optional): [Columns to load]. Defaults to all columns.
+        verbose (bool, optional): [When True prints size of data, load time and peak memory]. Defaults to False.
+        keep (tuple, optional): [Columns which are not converted to category]. Defaults to KEEP_COLUMNS.
+
+    Returns:
+        pd.DataFrame: [Data of car accidents with the same columns as get_dataframe]
+    """
+    start = timer()
+    if downloader is None:
+        downloader = DataDownloader()
+    if columns is None:
+        columns = COLUMNS
+    header, data = downloader.get_list(regions, columns=columns, decode=False)
+
+    frame = {}
+    for name, column in zip(header, data):
+        if isinstance(column, DictColumn) and name in keep:
+            frame[name] = column.decode()
+        elif isinstance(column, DictColumn):
+            #dictionary encoded strings already are categories and their codes
+            frame[name] = pd.Categorical.from_codes(column.codes, column.categories)
+        else:
+            if column.dtype.kind == "f":
+                #cache marks invalid numbers by -1, pickled data has missing values there
+                column = np.where(column == -1, np.nan, column)
+            frame[name] = column if name in keep else pd.Categorical(column)
+    if "p2a" in header:
+        frame["date"] = data[header.index("p2a")] if "date" in keep else frame["p2a"]
+    df = pd.DataFrame(frame, copy=False)
+    memo.bind(df, repr((downloader.fingerprint(regions), list(columns), tuple(keep))))
+    if verbose:
+        _report(None, df, start)
+    return df
+
 # Ukol 2: následky nehod v jednotlivých regionech
+@instrument.traced("conseq_sums")
+@memo.memoize(version=1)
+def conseq_sums(df: pd.DataFrame) -> pd.DataFrame:
+    """[Sums consequences of car accidents in every region, sorted by count of accidents]
+
+    Args:
+        df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
+
+    Returns:
+        pd.DataFrame: [Sums of p13a, p13b, p13c and count of accidents p1 indexed by region]
+    """
+    return df.groupby("region")\
+        .agg({"p13a":"sum","p13b":"sum","p13c":"sum","p1":"count"})\
+        .sort_values(by="p1",ascending=False)
+
+@instrument.traced("stream_conseq_sums", rows=lambda sums: int(sums["p1"].sum()))
+def stream_conseq_sums(downloader: DataDownloader, regions: list = None,
+                       memory_budget: int = BATCH_BUDGET) -> pd.DataFrame:
+    """[Sums consequences of car accidents in every region like conseq_sums, reads cache in batches]
+
+    Args:
+        downloader (DataDownloader): [Downloader with data of car accidents]
+        regions (list, optional): [Regions to load, None for every region]. Defaults to None.
+        memory_budget (int, optional): [Size of one batch in bytes]. Defaults to BATCH_BUDGET.
+
+    Returns:
+        pd.DataFrame: [Sums of p13a, p13b, p13c and count of accidents p1 indexed by region]
+    """
+    header, columns = downloader.aggregate(["region"], ["p13a", "p13b", "p13c"], regions, memory_budget=memory_budget)
+    df = pd.DataFrame({"p13a": columns[2], "p13b": columns[3], "p13c": columns[4], "p1": columns[1]},
+                      index=pd.Index(columns[0], name="region"))
+    #regions are sorted first like groupby sorts them, so regions with equal count keep the same order
+    return df.sort_index().sort_values(by="p1", ascending=False)
+
 def plot_conseq(df: pd.DataFrame, fig_location: str = None,
-                show_figure: bool = False):
+                show_figure: bool = False, sums: pd.DataFrame = None):
     """[Plots graphs showing consenquences of car accidents divied by regions]
 
     Args:
         df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
         fig_location (str, optional): [Saves graphs as image file]. Defaults to None.
         show_figure (bool, optional): [When True plots graphs on screen]. Defaults to False.
+        sums (pd.DataFrame, optional): [Precomputed result of conseq_sums or stream_conseq_sums,
+            df is not used then]. Defaults to None.
     """
     #Create dataframe containing only columns needed for this function
-    df1 = pd.DataFrame()
-    df1 = df.groupby("region")\
-        .agg({"p13a":"sum","p13b":"sum","p13c":"sum","p1":"count"})\
-        .sort_values(by="p1",ascending=False)
+    df1 = conseq_sums(df) if sums is None else sums
     
     #Set Figure and subplots
     fig,axes = plt.subplots(nrows=4,constrained_layout= True , figsize=(8,11))
@@ -78,152 +193,209 @@ def plot_conseq(df: pd.DataFrame, fig_location: str = None,
 
     """When not None saves graph into chosen folder"""
     if fig_location is not None:
-        plt.savefig(fig_location)
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
     """If show_figure flag is True plots data into window"""
     if show_figure:
         plt.show()
 
+#Regions shown in plot_damage and plot_surface by default
+PLOT_REGIONS = ("PHA", "JHC", "VYS", "PAK")
+
+def recode(values: pd.Series, func) -> pd.Categorical:
+    """[Applies func to categories of values only, rows get the result through their category codes]
+
+    Args:
+        values (pd.Series): [Values to convert, converted to category when they are not already]
+        func (callable): [Function converting array of unique values, may return pd.Categorical]
+
+    Returns:
+        pd.Categorical: [Converted values]
+    """
+    values = values.astype("category")
+    mapped = pd.Categorical(func(values.cat.categories))
+    codes = values.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, mapped.codes[codes], -1)
+    return pd.Categorical.from_codes(codes, mapped.categories)
+
+def count_cube(region: pd.Series, index: pd.Series, columns: pd.Series, regions: list = None,
+               weights: np.ndarray = None) -> pd.DataFrame:
+    """[Counts rows of every region, index bucket and column category in one pass over category codes]
+
+    Args:
+        region (pd.Series): [Region of every row]
+        index (pd.Series): [Bucket of every row, becomes second level of index]
+        columns (pd.Series): [Category of every row, becomes columns]
+        regions (list, optional): [Regions to count]. Defaults to all regions in data.
+        weights (np.ndarray, optional): [Count every row stands for, e.g. counts of rollup]. Defaults to 1 for every row.
+
+    Returns:
+        pd.DataFrame: [Counts indexed by (region, index bucket) with one column per category, slice it with .loc[region]]
+    """
+    region = pd.Categorical(region)
+    index = pd.Categorical(index)
+    columns = pd.Categorical(columns)
+    if regions is None:
+        regions = list(region.categories)
+
+    #position of every region category in regions, -1 for regions which are not counted
+    lookup = pd.Index(regions).get_indexer(region.categories)
+    r = np.where(region.codes >= 0, lookup[region.codes], -1)
+    valid = (r >= 0) & (index.codes >= 0) & (columns.codes >= 0)
+
+    shape = (len(regions), len(index.categories), len(columns.categories))
+    flat = (r[valid].astype(np.int64) * shape[1] + index.codes[valid]) * shape[2] + columns.codes[valid]
+    weights = None if weights is None else np.asarray(weights)[valid]
+    counts = np.bincount(flat, weights=weights, minlength=shape[0] * shape[1] * shape[2]).astype(np.int64)
+    counts = counts.reshape(shape[0] * shape[1], shape[2])
+    return pd.DataFrame(counts,
+                        index=pd.MultiIndex.from_product([regions, index.categories], names=["region", "index"]),
+                        columns=columns.categories)
+
+def _nonzero(df: pd.DataFrame) -> pd.DataFrame:
+    """[Drops categories which never occur, like pivot_table does]"""
+    return df.loc[:, (df != 0).any(axis=0)]
+
 # Ukol3: příčina nehody a škoda
+@instrument.traced("damage_cube")
+@memo.memoize(version=1)
+def damage_cube(df: pd.DataFrame, regions: list = None) -> pd.DataFrame:
+    """[Counts accidents by region, financial damage group and cause]
+
+    Args:
+        df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
+        regions (list, optional): [Regions to count]. Defaults to all regions in data.
+
+    Returns:
+        pd.DataFrame: [Counts indexed by (region, damage group) with one column per cause]
+    """
+    #Cut money data into 5 groups, only unique values are cut
+    money = recode(df["p53"], lambda values: pd.cut(np.asarray(values, dtype=float),[0,500,2000,5000,10000,float("inf")],
+                   labels=["<50","50-200","200-500","500-1000",">1000"],include_lowest=True))
+
+    #Convert int values of car accident reasons into string values
+    bins = pd.IntervalIndex.from_tuples([(99,100), (200,209), (300,311), (400,414), (500,516), (600,615)])
+    cause = recode(df["p12"], lambda values: pd.cut(np.asarray(values, dtype=float),bins))
+    cause = cause.rename_categories(["nezaviněná řidičem","nepřiměřená rychlost jízdy","nesprávné předjíždění","nedání přednosti v jízdě",
+    "nesprávný způsob jízdy","technická závada vozidla"])
+
+    return count_cube(df["region"], money, cause, regions)
+
 def plot_damage(df: pd.DataFrame, fig_location: str = None,
-                show_figure: bool = False):
+                show_figure: bool = False, regions: tuple = PLOT_REGIONS):
     """[Plots graphs showing financial casualities of car accidents in regions: PHA,JHC,VYS,PAK]
 
     Args:
         df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
         fig_location (str, optional): [Saves graphs as image file]. Defaults to None.
         show_figure (bool, optional): [When True plots graphs on screen]. Defaults to False.
-    """   
-    #create DataFrame containing only needed columns for this function, also separate data only from 4 needed regions
-    dftemp = pd.DataFrame()
-    dftemp["region"] = df["region"]
-    dftemp["money"] = df["p53"]
-    dftemp["cause"] = df["p12"]
-    dftemp = dftemp[(dftemp["region"] == "PHA") | (dftemp["region"] == "JHC") | (dftemp["region"] == "VYS") | (dftemp["region"] == "PAK")]
-    
-    #Cut money data into 5 groups
-    dftemp["money"]= pd.cut(dftemp["money"],[0,500,2000,5000,10000,float("inf")],labels=["<50","50-200","200-500","500-1000",">1000"],include_lowest=True)
-    
-    #Convert int values of car accident reasons into string values
-    bins = pd.IntervalIndex.from_tuples([(99,100), (200,209), (300,311), (400,414), (500,516), (600,615)])
-    tempcause = pd.cut(dftemp["cause"].to_list(),bins)
-    tempcause.categories = ["nezaviněná řidičem","nepřiměřená rychlost jízdy","nesprávné předjíždění","nedání přednosti v jízdě",
-    "nesprávný způsob jízdy","technická závada vozidla"]
-    dftemp["cause"] = tempcause
-
-    #Pivot Dataframe into separate DataFrames for each region
-    dfPHA = dftemp[dftemp["region"] == "PHA"].pivot_table(index="money",columns="cause",aggfunc="count")
-    dfJHC = dftemp[dftemp["region"] == "JHC"].pivot_table(index="money",columns="cause",aggfunc="count")
-    dfVYS = dftemp[dftemp["region"] == "VYS"].pivot_table(index="money",columns="cause",aggfunc="count")
-    dfPAK = dftemp[dftemp["region"] == "PAK"].pivot_table(index="money",columns="cause",aggfunc="count")
-    
+        regions (tuple, optional): [Four regions to plot]. Defaults to PLOT_REGIONS.
+    """
+    #count all regions in single pass, plots of any regions only take slices of the same memoized result
+    cube = damage_cube(df)
+
     #Create Figure and subplots
     fig,axes = plt.subplots(nrows=2,ncols=2,constrained_layout= True , figsize=(11,8))
-    (ax1,ax2),(ax3,ax4) = axes
 
-    #Set background colors for subplots
-    ax1.set_facecolor((0.9,0.95,1))
-    ax2.set_facecolor((0.9,0.95,1))
-    ax3.set_facecolor((0.9,0.95,1))
-    ax4.set_facecolor((0.9,0.95,1))
-
-    #Plot DataFrames
-    dfPHA.plot(kind="bar",ax=ax1,logy=True,title="PHA",xlabel="Škoda [tisíc Kč]",rot=0,ylabel="Počet",legend= False)
-    dfJHC.plot(kind="bar",ax=ax2,logy=True,title="JHC",xlabel="Škoda [tisíc Kč]",rot=0,ylabel="Počet",legend= False)
-    dfVYS.plot(kind="bar",ax=ax3,logy=True,title="VYS",xlabel="Škoda [tisíc Kč]",rot=0,ylabel="Počet",legend= False)
-    dfPAK.plot(kind="bar",ax=ax4,logy=True,title="PAK",xlabel="Škoda [tisíc Kč]",rot=0,ylabel="Počet")
+    for i, (ax, region) in enumerate(zip(axes.flat, regions)):
+        #Set background color and plot counts of region
+        ax.set_facecolor((0.9,0.95,1))
+        _nonzero(cube.loc[region]).plot(kind="bar",ax=ax,logy=True,title=region,xlabel="Škoda [tisíc Kč]",rot=0,
+                                        ylabel="Počet" if i % 2 == 0 else "",legend= False)
 
-    #Set Grid for Y axis in subplots
-    ax1.grid(which="major",axis="y",color=("white"),linewidth=1)
-    ax1.set_axisbelow(True)
-    ax1.minorticks_off()
-    ax2.grid(which="major",axis="y",color=("white"),linewidth=1)
-    ax2.set_axisbelow(True)
-    ax2.minorticks_off()
-    ax3.grid(which="major",axis="y",color=("white"),linewidth=1)
-    ax3.set_axisbelow(True)
-    ax3.minorticks_off()
-    ax4.grid(which="major",axis="y",color=("white"),linewidth=1)
-    ax4.set_axisbelow(True)
-    ax4.minorticks_off()
+        #Set Grid for Y axis in subplot
+        ax.grid(which="major",axis="y",color=("white"),linewidth=1)
+        ax.set_axisbelow(True)
+        ax.minorticks_off()
 
     #Set legend
-    handles, labels = ax1.get_legend_handles_labels()
-    ax4.legend(handles, ("nezaviněná řidičem","nepřiměřená rychlost jízdy","nesprávné předjíždění","nedání přednosti v jízdě",
-    "nesprávný způsob jízdy","technická závada vozidla"), loc='upper right',title="Příčina nehody", bbox_to_anchor=(1.2, 1.2))
+    handles, labels = axes[0][0].get_legend_handles_labels()
+    axes[1][1].legend(handles, labels, loc='upper right',title="Příčina nehody", bbox_to_anchor=(1.2, 1.2))
 
 
     """When not None saves graph into chosen folder"""
     if fig_location is not None:
-        plt.savefig(fig_location)
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
     """If show_figure flag is True plots data into window"""
     if show_figure:
         plt.show()
 
 # Ukol 4: povrch vozovky
+@instrument.traced("surface_cube")
+@memo.memoize(version=1)
+def surface_cube(df: pd.DataFrame, regions: list = None) -> pd.DataFrame:
+    """[Counts accidents by region, month and road surface state]
+
+    Args:
+        df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
+        regions (list, optional): [Regions to count]. Defaults to all regions in data.
+
+    Returns:
+        pd.DataFrame: [Counts indexed by (region, month) with one column per road surface state]
+    """
+    #convert date column values into months, only unique dates are converted
+    month = recode(df["date"], lambda values: pd.DatetimeIndex(values).to_period("M").to_timestamp())
+    return count_cube(df["region"], month, df["p16"], regions)
+
+@instrument.traced("rollup_surface_cube")
+def rollup_surface_cube(downloader: DataDownloader, regions: list = None) -> pd.DataFrame:
+    """[Counts accidents by region, month and road surface state like surface_cube, from rollup store of cache
+
+    Args:
+        downloader (DataDownloader): [Downloader with data of car accidents]
+        regions (list, optional): [Regions to count]. Defaults to all regions in data.
+
+    Returns:
+        pd.DataFrame: [Counts indexed by (region, month) with one column per road surface state]
+    """
+    #months of every region are summed from days, so months and states of all regions are known like in surface_cube
+    header, columns = downloader.rollup("p16", period="M")
+    month = pd.DatetimeIndex(columns[1].astype("datetime64[ns]"))
+    return count_cube(columns[0], month, columns[2], regions, columns[3])
+
 def plot_surface(df: pd.DataFrame, fig_location: str = None,
-                 show_figure: bool = False):
+                 show_figure: bool = False, regions: tuple = PLOT_REGIONS, cube: pd.DataFrame = None):
     """[Plots graphs showing weather conditions in car accidents in regions: PHA,JHC,VYS,PAK]
 
     Args:
         df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
         fig_location (str, optional): [Saves graphs as image file]. Defaults to None.
         show_figure (bool, optional): [When True plots graphs on screen]. Defaults to False.
+        regions (tuple, optional): [Four regions to plot]. Defaults to PLOT_REGIONS.
+        cube (pd.DataFrame, optional): [Precomputed result of surface_cube or rollup_surface_cube,
+            df is not used then]. Defaults to None.
     """
-
-    #create DataFrame containing only needed columns for this function, also separate data only from 4 needed regions
-    dftemp = pd.DataFrame()
-    dftemp["region"] = df["region"]
-    dftemp["roadstate"] = df["p16"]
-    #convert date column values into datetime months
-    dftemp["date"] = df["date"].astype('datetime64[M]')
-    dftemp = dftemp[(dftemp["region"] == "PHA") | (dftemp["region"] == "JHC") | (dftemp["region"] == "VYS") | (dftemp["region"] == "PAK")]
-
-    #Pivot DataFrames for each separate region, set NaN values to 0
-    dfPHA = dftemp[dftemp["region"] == "PHA"].pivot_table(index="date",columns="roadstate",aggfunc="count").fillna(0)
-    dfJHC = dftemp[dftemp["region"] == "JHC"].pivot_table(index="date",columns="roadstate",aggfunc="count").fillna(0)
-    dfVYS = dftemp[dftemp["region"] == "VYS"].pivot_table(index="date",columns="roadstate",aggfunc="count").fillna(0)
-    dfPAK = dftemp[dftemp["region"] == "PAK"].pivot_table(index="date",columns="roadstate",aggfunc="count").fillna(0)
+    #count all regions in single pass, plots of any regions only take slices of the same memoized result
+    if cube is None:
+        cube = surface_cube(df)
 
     #Create Figure and subplots
     fig,axes = plt.subplots(nrows=2,ncols=2,constrained_layout= True , figsize=(13,7))
-    (ax1,ax2),(ax3,ax4) = axes
-    
-    #Set background colors for subplots
-    ax1.set_facecolor((0.9,0.95,1))
-    ax2.set_facecolor((0.9,0.95,1))
-    ax3.set_facecolor((0.9,0.95,1))
-    ax4.set_facecolor((0.9,0.95,1))
 
-    #Plot DataFrames of separate regions into subplots
-    dfPHA.plot(kind="line",ax=ax1,title="PHA",rot=0,ylabel="Počet nehod",legend= False,xlabel="")
-    dfJHC.plot(kind="line",ax=ax2,title="JHC",rot=0,legend= False,xlabel="")
-    dfVYS.plot(kind="line",ax=ax3,title="VYS",xlabel="Datum vzniku nehody",rot=0,ylabel="Počet nehod",legend= False)
-    dfPAK.plot(kind="line",ax=ax4,title="PAK",xlabel="Datum vzniku nehody",rot=0,legend= False)
-    
-    #Set Grid for both axis in subplots
-    ax1.grid(which="major",axis="both",color=("white"),linewidth=1)
-    ax1.set_axisbelow(True)
-    ax1.minorticks_off()
-    ax2.grid(which="major",axis="both",color=("white"),linewidth=1)
-    ax2.set_axisbelow(True)
-    ax2.minorticks_off()
-    ax3.grid(which="major",axis="both",color=("white"),linewidth=1)
-    ax3.set_axisbelow(True)
-    ax3.minorticks_off()
-    ax4.grid(which="major",axis="both",color=("white"),linewidth=1)
-    ax4.set_axisbelow(True)
-    ax4.minorticks_off()
+    for i, (ax, region) in enumerate(zip(axes.flat, regions)):
+        #Set background color and plot counts of region, bottom row gets x label and left column y label
+        ax.set_facecolor((0.9,0.95,1))
+        _nonzero(cube.loc[region]).plot(kind="line",ax=ax,title=region,rot=0,legend= False,
+                                        xlabel="Datum vzniku nehody" if i >= 2 else "",
+                                        ylabel="Počet nehod" if i % 2 == 0 else "")
+
+        #Set Grid for both axis in subplot
+        ax.grid(which="major",axis="both",color=("white"),linewidth=1)
+        ax.set_axisbelow(True)
+        ax.minorticks_off()
 
     #Set Legend
-    handles, labels = ax1.get_legend_handles_labels()
-    ax4.legend(handles, ("jiný stav","suchý,neznečistěný","suchý,znečistěný","mokrý","bláto","náledí,ujetý sníh - posypané",
+    handles, labels = axes[0][0].get_legend_handles_labels()
+    axes[1][1].legend(handles, ("jiný stav","suchý,neznečistěný","suchý,znečistěný","mokrý","bláto","náledí,ujetý sníh - posypané",
     "náledí,ujetý sníh - neposypané","rozlitý olej, nafta a pod.","souvislý sníh","náhlá změna stavu"), loc='upper right',
     title="Stav vozovky", bbox_to_anchor=(1.6, 1.3))
 
 
     """When not None saves graph into chosen folder"""
     if fig_location is not None:
-        plt.savefig(fig_location)
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
     """If show_figure flag is True plots data into window"""
     if show_figure:
         plt.show()
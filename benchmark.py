@@ -0,0 +1,293 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import tracemalloc
+import zipfile
+from timeit import default_timer as timer
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import mercantile
+import numpy as np
+import pandas as pd
+import pyproj
+from PIL import Image
+
+import analysis
+import doc
+import geo
+import get_stat
+import memo
+import tiles
+from download import DataDownloader, SCHEMA, REGIONS, HEADER, COLUMNS
+
+#cause codes used by analysis.damage_cube
+CAUSES = [100] + list(range(201, 210)) + list(range(301, 312)) + list(range(401, 415)) \
+    + list(range(501, 517)) + list(range(601, 616))
+#string values of text columns, they have to be encodable in windows-1250
+TEXTS = np.array(["", "Hlavní", "Nádražní", "Silnice 1. třídy", "Dálnice D1", "Účelová komunikace",
+                  "Křižovatka", "Žďár nad Sázavou", "Ústí nad Labem"])
+
+
+def _column(rng: np.random.Generator, name: str, dtype, rows: int, year: int, ids: np.ndarray) -> np.ndarray:
+    """[Generates string values of one csv column resembling data of the IZV site]"""
+    if name == "p1":
+        return ids.astype(str)
+    if name == "p2a":
+        days = rng.integers(0, 365, rows)
+        return np.datetime_as_string(np.datetime64("{}-01-01".format(year)) + days, unit="D")
+    if name in ("p13a", "p13b", "p13c"):
+        return rng.poisson({"p13a": 0.01, "p13b": 0.05, "p13c": 0.3}[name], rows).astype(str)
+    if name == "p12":
+        return rng.choice(CAUSES, rows).astype(str)
+    if name == "p53":
+        return rng.integers(0, 20000, rows).astype(str)
+    if name == "p5a":
+        return rng.integers(1, 3, rows).astype(str)
+    if name in ("d", "e"):
+        #S-JTSK coordinates with decimal comma, some records have no position
+        low, high = (-900000, -430000) if name == "d" else (-1230000, -935000)
+        values = np.char.replace(np.round(rng.uniform(low, high, rows), 2).astype(str), ".", ",")
+        return np.where(rng.random(rows) < 0.02, "", values)
+    if dtype is np.float64:
+        return np.char.replace(np.round(rng.uniform(0, 1000, rows), 3).astype(str), ".", ",")
+    if dtype is str:
+        return rng.choice(TEXTS, rows)
+    if dtype is np.int8:
+        return rng.integers(0, 10, rows).astype(str)
+    return rng.integers(0, 1000, rows).astype(str)
+
+
+def make_archives(folder: str, rows: int, years: tuple = (2016, 2017, 2018, 2019, 2020), seed: int = 1) -> int:
+    """[Writes synthetic zip archives with csv file of every region in layout of the IZV site
+
+    Every archive is named datagis-rok-<year>.zip and contains 64 columns separated by ;
+    encoded in windows-1250 for every region member 00.csv ... 19.csv.]
+
+    Args:
+        folder (str): [Folder for archives]
+        rows (int): [Count of records of every region in every archive]
+        years (tuple, optional): [Year of every archive]. Defaults to (2016, 2017, 2018, 2019, 2020).
+        seed (int, optional): [Seed of random generator]. Defaults to 1.
+
+    Returns:
+        int: [Size of all csv files in bytes]
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    size = 0
+    for year in years:
+        with zipfile.ZipFile(os.path.join(folder, "datagis-rok-{}.zip".format(year)), "w", zipfile.ZIP_DEFLATED) as archive:
+            for number, member in enumerate(sorted(REGIONS.values())):
+                #accident ids are unique across regions and archives
+                ids = (number * 100 + year % 100) * 10 ** 7 + np.arange(rows)
+                columns = [_column(rng, name, dtype, rows, year, ids) for name, dtype in SCHEMA[:len(HEADER)]]
+                content = "".join(";".join(row) + "\r\n" for row in zip(*[column.tolist() for column in columns]))
+                data = content.encode("windows-1250")
+                size += len(data)
+                archive.writestr(member, data)
+    return size
+
+
+def seed_tiles(folder: str, x: np.ndarray, y: np.ndarray) -> int:
+    """[Writes plain tiles covering points into folder in {z}/{x}/{y}.png layout, so basemaps are drawn without network
+
+    Args:
+        folder (str): [Folder for tiles]
+        x (np.ndarray): [X coordinates of points in S-JTSK]
+        y (np.ndarray): [Y coordinates of points in S-JTSK]
+
+    Returns:
+        int: [Count of written tiles]
+    """
+    w, s, e, n = pyproj.Transformer.from_crs(geo.CRS, "EPSG:4326", always_xy=True).transform_bounds(
+        np.nanmin(x), np.nanmin(y), np.nanmax(x), np.nanmax(y))
+    #axes of plots are a bit larger than their points, so zoom chosen for them may differ by one level
+    dw, dn = (e - w) / 10, (n - s) / 10
+    w, s, e, n = w - dw, s - dn, e + dw, n + dn
+    zoom = tiles._zoom(w, s, e, n)
+    image = io.BytesIO()
+    Image.new("RGB", (256, 256), (224, 224, 224)).save(image, "PNG")
+    count = 0
+    for tile in mercantile.tiles(w, s, e, n, range(max(zoom - 1, 0), zoom + 2)):
+        filename = os.path.join(folder, str(tile.z), str(tile.x), str(tile.y) + ".png")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(image.getvalue())
+        count += 1
+    return count
+
+
+def measure(func, repeat: int = 1, memory: bool = True) -> dict:
+    """[Runs func repeatedly and measures the fastest run, peak memory is measured in one extra run
+
+    Args:
+        func (callable): [Measured function, returns count of processed rows]
+        repeat (int, optional): [Count of timed runs]. Defaults to 1.
+        memory (bool, optional): [When True peak of allocated memory is traced in extra run]. Defaults to True.
+
+    Returns:
+        dict: [Time of the fastest run, count of rows, rows per second and peak memory]
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = timer()
+        rows = func()
+        times.append(timer() - start)
+    result = {"seconds": min(times), "rows": rows, "rows_per_s": rows / min(times) if min(times) > 0 else None}
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1048576
+        tracemalloc.stop()
+    plt.close("all")
+    return result
+
+
+def run(folder: str, rows: int, years: tuple, repeat: int = 3, workers: int = None, memory: bool = True) -> dict:
+    """[Generates synthetic data into folder and measures every stage of processing
+
+    Args:
+        folder (str): [Working folder, archives, caches and pickled data are written there]
+        rows (int): [Count of records of every region in every archive]
+        years (tuple): [Year of every archive]
+        repeat (int, optional): [Count of timed runs of every stage]. Defaults to 3.
+        workers (int, optional): [Count of processes parsing archives]. Defaults to None.
+        memory (bool, optional): [When True peak memory of every stage is measured]. Defaults to True.
+
+    Returns:
+        dict: [Results of stages with configuration and environment]
+    """
+    datafolder = os.path.join(folder, "data")
+    cachefolder = os.path.join(folder, "cache")
+    pickle = os.path.join(folder, "accidents.pkl.gz")
+    seedfolder = os.path.join(folder, "seed")
+    #aggregates are always computed and basemap tiles are never downloaded, they are taken from seeded folder
+    memo.configure(enabled=False)
+    tiles.configure(folder=os.path.join(folder, "tiles"), offline=True, seed=seedfolder,
+                    source=os.path.join(seedfolder, "{z}", "{x}", "{y}.png"))
+
+    start = timer()
+    csvbytes = make_archives(datafolder, rows, years)
+    results = {"generate": {"seconds": timer() - start, "bytes": csvbytes}}
+    total = rows * len(years) * len(REGIONS)
+    downloader = DataDownloader(folder=datafolder, cache_filename=os.path.join(cachefolder, "data_{}"))
+
+    def stage(name, func, size=None, **kwargs):
+        try:
+            results[name] = measure(func, **kwargs)
+        except Exception as error:
+            results[name] = {"error": repr(error)}
+            return
+        if size is not None:
+            results[name]["mb_per_s"] = size / 1048576 / results[name]["seconds"]
+        print("{:24} {:>8.3f} s".format(name, results[name]["seconds"]))
+
+    def cold():
+        shutil.rmtree(cachefolder, ignore_errors=True)
+        os.makedirs(cachefolder)
+        return len(downloader.get_list(workers=workers)[1][0])
+
+    stage("parse_region_data", lambda: len(downloader.parse_region_data("PHA")[1][0]),
+          csvbytes / len(REGIONS), repeat=repeat, memory=memory)
+    stage("get_list_cold", cold, csvbytes, repeat=repeat, memory=memory)
+    stage("get_list_warm", lambda: len(downloader.get_list(workers=workers)[1][0]), csvbytes, repeat=repeat, memory=memory)
+
+    #pickled frame has the layout of accidents.pkl.gz, records without position have missing coordinates
+    header, columns = downloader.get_list(columns=COLUMNS)
+    frame = pd.DataFrame(dict(zip(header, columns)))
+    for name in ("d", "e"):
+        frame[name] = frame[name].where(frame[name] != -1)
+    frame.to_pickle(pickle)
+    del frame, columns
+
+    stage("get_dataframe", lambda: len(analysis.get_dataframe(pickle)), repeat=repeat, memory=memory)
+    stage("load_dataframe", lambda: len(analysis.load_dataframe(downloader)), repeat=repeat, memory=memory)
+    df = analysis.get_dataframe(pickle)
+    stage("conseq_sums", lambda: int(analysis.conseq_sums(df)["p1"].sum()), repeat=repeat, memory=memory)
+    stage("damage_cube", lambda: int(analysis.damage_cube(df).to_numpy().sum()), repeat=repeat, memory=memory)
+    stage("surface_cube", lambda: int(analysis.surface_cube(df).to_numpy().sum()), repeat=repeat, memory=memory)
+    stage("rollup_surface_cube", lambda: int(analysis.rollup_surface_cube(downloader).to_numpy().sum()),
+          repeat=repeat, memory=memory)
+    stage("count_stat", lambda: int(get_stat.count_stat(downloader.get_list(columns=["p2a", "region"]))[2].sum()),
+          repeat=repeat, memory=memory)
+    del df
+
+    docdf = doc.get_dataframe(pickle)
+    stage("influence_counts", lambda: int(doc.influence_counts(docdf)["nehody"].sum()), repeat=repeat, memory=memory)
+    del docdf
+
+    raw = pd.read_pickle(pickle)
+    stage("make_geo", lambda: len(geo.make_geo(raw)), repeat=repeat, memory=memory)
+    stage("make_geo_lean", lambda: len(geo.make_geo(raw, geo.GEO_COLUMNS, lazy=True)), repeat=repeat, memory=memory)
+    gdf = geo.make_geo(raw, geo.GEO_COLUMNS, lazy=True)
+    del raw
+    results["seed_tiles"] = {"tiles": seed_tiles(seedfolder, gdf["d"].to_numpy(), gdf["e"].to_numpy())}
+    stage("cluster_kmeans", lambda: int(geo.cluster_centroids(gdf)[1].sum()), repeat=repeat, memory=memory)
+    stage("cluster_grid", lambda: int(geo.cluster_centroids(gdf, None, None, "grid")[1].sum()), repeat=repeat, memory=memory)
+    stage("plot_cluster", lambda: geo.plot_cluster(gdf, os.path.join(folder, "cluster.png")) or len(gdf), repeat=1, memory=False)
+
+    return {
+        "config": {"rows": rows, "years": list(years), "records": total, "repeat": repeat, "workers": workers},
+        "environment": environment(),
+        "stages": results,
+    }
+
+
+def environment() -> dict:
+    """[Returns versions of python, libraries and source tree the results were measured with]"""
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    return {"revision": revision, "python": platform.python_version(), "numpy": np.__version__,
+            "pandas": pd.__version__, "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(old: dict, new: dict):
+    """[Prints time of every stage in both results and their ratio]"""
+    print("{:24} {:>10} {:>10} {:>8}".format("stage", "old [s]", "new [s]", "ratio"))
+    for name, result in new["stages"].items():
+        before = old["stages"].get(name, {}).get("seconds")
+        after = result.get("seconds")
+        if before is None or after is None:
+            continue
+        print("{:24} {:>10.3f} {:>10.3f} {:>8.2f}".format(name, before, after, after / before if before else float("nan")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures processing of synthetic IZV data")
+    parser.add_argument("--rows", type=int, default=2000, help="records of every region in every archive")
+    parser.add_argument("--years", type=int, nargs="+", default=[2016, 2017, 2018, 2019, 2020], help="year of every archive")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of every stage")
+    parser.add_argument("--workers", type=int, default=None, help="processes parsing archives")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracing of peak memory")
+    parser.add_argument("--folder", default=None, help="working folder, temporary folder by default")
+    parser.add_argument("--output", default="benchmark.json", help="file the results are written to")
+    parser.add_argument("--compare", default=None, help="earlier results to compare with")
+    args = parser.parse_args()
+
+    folder = args.folder or tempfile.mkdtemp(prefix="izv-benchmark-")
+    try:
+        results = run(folder, args.rows, tuple(args.years), args.repeat, args.workers, not args.no_memory)
+    finally:
+        if args.folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
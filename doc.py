@@ -6,29 +6,24 @@ import pandas as pd
 import seaborn as sns
 import numpy as np
 import os
+import analysis
+from download import DataDownloader
+import memo
+import instrument
 
 def get_dataframe(filename: str) -> pd.DataFrame:
-    """[Gets dataframe from file and converts its types to save memory]
+    """[Gets dataframe from file and converts its types to save memory, p11 and date are kept unconverted]
 
     Args:
         filename (str): [file containing data to be converted]
-        verbose (bool, optional): [When True prints size of data before and after conversion]. Defaults to False.
 
     Returns:
         pd.DataFrame: [Data from filename converted to DataFrame]
     """
-    df = pd.read_pickle(filename)
-    df1 = pd.DataFrame()
-    df1["date"] = df["p2a"].apply(lambda x: x)
-    for column in df:
-        if column == "region" or column == "p13a" or column == "p13b" or column == "p13c" or column == "p1" or column == "p11":
-            df1[column] = df[column]
-        else:
-            df1[column] = df[column].astype("category")
-    return df1
+    return analysis.get_dataframe(filename, keep=analysis.KEEP_COLUMNS + ("p11", "date"))
 
 def get_percentage(a,b):
-    """[Calculates percentage out of 2 values]
+    """[Calculates percentage out of 2 values, works for whole columns as well]
     
     Args:
         a : [int value of item]
@@ -39,84 +34,106 @@ def get_percentage(a,b):
     temp = a/b
     return round(temp * 100,2)
 
+#p11 codes of every influence class, accidents with other codes than triezvo count as under influence
+INFLUENCE_CLASSES = {
+    "triezvo": (0, 2),
+    "alk<0.5": (1, 3),
+    "alk>0.5<1.0": (6, 7),
+    "alk>1.0": (8, 9),
+    "drogy": (4, 5),
+}
+
+@instrument.traced("influence_counts")
+@memo.memoize(version=2)
+def influence_counts(df: pd.DataFrame) -> pd.DataFrame:
+    """[Counts accidents of every year by influence of alcohol and drugs]
+
+    Args:
+        df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
+
+    Returns:
+        pd.DataFrame: [Counts of all accidents and of every influence group indexed by year]
+    """
+    #years and p11 values are taken from categories only, rows keep just their codes
+    year = analysis.recode(df["date"], lambda values: pd.DatetimeIndex(values).year.astype(str))
+    influence = pd.Categorical(df["p11"])
+    return influence_table(year, influence)
+
+@instrument.traced("rollup_influence_counts")
+def rollup_influence_counts(downloader: DataDownloader, regions: list = None) -> pd.DataFrame:
+    """[Counts accidents of every year by influence of alcohol and drugs like influence_counts, from rollup store of cache
+
+    Args:
+        downloader (DataDownloader): [Downloader with data of car accidents]
+        regions (list, optional): [Regions to count]. Defaults to all regions.
+
+    Returns:
+        pd.DataFrame: [Counts of all accidents and of every influence group indexed by year]
+    """
+    header, columns = downloader.rollup("p11", regions, period="Y")
+    return influence_table(pd.Categorical(columns[1].astype(str)), pd.Categorical(columns[2]), columns[3])
+
+def influence_table(year: pd.Categorical, influence: pd.Categorical, weights: np.ndarray = None) -> pd.DataFrame:
+    """[Counts rows of every year and p11 code and sums the codes into influence classes
+
+    Args:
+        year (pd.Categorical): [Year of every row as string]
+        influence (pd.Categorical): [p11 code of every row]
+        weights (np.ndarray, optional): [Count every row stands for]. Defaults to 1 for every row.
+
+    Returns:
+        pd.DataFrame: [Counts of all accidents and of every influence group indexed by year]
+    """
+    #count every (year, p11 code) pair in single pass
+    valid = (year.codes >= 0) & (influence.codes >= 0)
+    shape = (len(year.categories), len(influence.categories))
+    table = np.bincount(year.codes[valid].astype(np.int64) * shape[1] + influence.codes[valid],
+                        weights=None if weights is None else np.asarray(weights)[valid],
+                        minlength=shape[0] * shape[1]).astype(np.int64).reshape(shape)
+
+    #influence classes are sums of their p11 codes
+    counts = pd.DataFrame({"nehody": table.sum(axis=1)}, index=pd.Index(year.categories, name="date"))
+    for name, codes in INFLUENCE_CLASSES.items():
+        counts[name] = table[:, np.isin(np.asarray(influence.categories), codes)].sum(axis=1)
+    counts.insert(2, "podvplyvom", counts["nehody"] - counts["triezvo"])
+    return counts
+
 def doc(df: pd.DataFrame, fig_location: str = None,
-                 show_figure: bool = False):
+                 show_figure: bool = False, counts: pd.DataFrame = None):
     """[Plots graphs showing percentages of accidents caused by alcohol and drugs]
 
     Args:
         df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016]
         fig_location (str, optional): [Saves graphs as image file]. Defaults to None.
         show_figure (bool, optional): [When True plots graphs on screen]. Defaults to False.
+        counts (pd.DataFrame, optional): [Precomputed result of influence_counts or rollup_influence_counts,
+            df is not used then]. Defaults to None.
     """
-    #create DataFrame containing only needed columns for this function, also separate data only from 4 needed regions
-    dftemp = pd.DataFrame()
-    dftemp["nehody"] = df["p11"]
-    
-    #convert date column values into datetime years
-    dftemp["date"] = df["date"].astype('datetime64[Y]')
-    
-    #separate values by ammount of alcohol and drugs 
-    dftriezvo = dftemp[(dftemp["nehody"] == 0) | (dftemp["nehody"] == 2)]
-    dfnehody = dftemp[(dftemp["nehody"] != 0) & (dftemp["nehody"] != 2)]
-    dfdrogy = dfnehody[(dfnehody["nehody"] == 4) |(dfnehody["nehody"] == 5)]
-    dfalk_low = dfnehody[(dfnehody["nehody"] == 1) |(dfnehody["nehody"] == 3)]
-    dfalk_mid = dfnehody[(dfnehody["nehody"] == 6) |(dfnehody["nehody"] == 7)]
-    dfalk_high = dfnehody[(dfnehody["nehody"] == 8) |(dfnehody["nehody"] == 9)]
-    
-    #agregate separated values
-    dftemp = dftemp.groupby(by=["date"]).count()
-    dftriezvo = dftriezvo.groupby(by=["date"]).count()
-    dfnehody = dfnehody.groupby(by=["date"]).count()
-    dfdrogy = dfdrogy.groupby(by=["date"]).count()
-    dfalk_low = dfalk_low.groupby(by=["date"]).count()
-    dfalk_mid = dfalk_mid.groupby(by=["date"]).count()
-    dfalk_high = dfalk_high.groupby(by=["date"]).count()
-    
-    #insert values as columns
-    dftemp["triezvo"] = dftriezvo["nehody"]
-    dftemp["podvplyvom"] = dfnehody["nehody"]
-    dftemp["alk<0.5"] = dfalk_low["nehody"]
-    dftemp["alk>0.5<1.0"] = dfalk_mid["nehody"]
-    dftemp["alk>1.0"] = dfalk_high["nehody"]
-    dftemp["drogy"] = dfdrogy["nehody"]
-    
-    #reset index to date and cut months and days values
-    dftemp = dftemp.reset_index()
-    dftemp["date"] = ["2016","2017","2018","2019","2020"]
-    dftemp = dftemp.set_index("date")
-    
-    #create lists to store percentage values into
-    percentage = []
-    alklow_percentage = []
-    alkmid_percentage = []
-    alkhigh_percentage = []
-    drugs_percentage = []
-    
-    #calculate percentage values for every year
-    for index,row in dftemp.iterrows():
-        percentage.append(get_percentage(row["podvplyvom"],row["nehody"]))
-        alklow_percentage.append(get_percentage(row["alk<0.5"],row["podvplyvom"]))
-        alkmid_percentage.append(get_percentage(row["alk>0.5<1.0"],row["podvplyvom"]))
-        alkhigh_percentage.append(get_percentage(row["alk>1.0"],row["podvplyvom"]))
-        drugs_percentage.append(get_percentage(row["drogy"],row["podvplyvom"]))
-   
-    #create dataframe for percentage values
-    dfpercentage = pd.DataFrame(list(zip(percentage,alklow_percentage,alkmid_percentage,alkhigh_percentage,drugs_percentage)),
-                                index=["2016","2017","2018","2019","2020"],
-                               columns=["pod vplyvom %","alk<0.5 %","0.5 < alk <1.0 %","alk>1.0 %","drogy %"])
+    dftemp = influence_counts(df) if counts is None else counts
+    years = list(dftemp.index)
+
+    #calculate percentage values for every year at once
+    dfpercentage = pd.DataFrame({
+        "pod vplyvom %": get_percentage(dftemp["podvplyvom"], dftemp["nehody"]),
+        "alk<0.5 %": get_percentage(dftemp["alk<0.5"], dftemp["podvplyvom"]),
+        "0.5 < alk <1.0 %": get_percentage(dftemp["alk>0.5<1.0"], dftemp["podvplyvom"]),
+        "alk>1.0 %": get_percentage(dftemp["alk>1.0"], dftemp["podvplyvom"]),
+        "drogy %": get_percentage(dftemp["drogy"], dftemp["podvplyvom"]),
+    })
     
     #plot percentage values 
     dfpercentage.plot(kind="bar",rot=0,y=["alk<0.5 %","0.5 < alk <1.0 %","alk>1.0 %","drogy %"])
     
     #print tables of amount of accidents and percentages of accidents
-    print("Počet nehod od 2016 po 2020:\n")
+    print("Počet nehod od {} po {}:\n".format(years[0], years[-1]))
     print(dftemp)
-    print("\nPercento nehod od 2016 po 2020:\n")
+    print("\nPercento nehod od {} po {}:\n".format(years[0], years[-1]))
     print(dfpercentage)
     
     #When not None saves graph into chosen folder
     if fig_location is not None:
-        plt.savefig(fig_location)
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
     #If show_figure flag is True plots data into window
     if show_figure:
         plt.show()
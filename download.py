@@ -4,11 +4,15 @@ from os import path
 import zipfile
 import os
 import numpy as np
-import csv
-from io import TextIOWrapper
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+from io import BytesIO
 from timeit import default_timer as timer
-import pickle
-import gzip as gz
+import json
+import hashlib
+import re
+import instrument
 
 def isFloat(string):
     try:
@@ -25,17 +29,592 @@ def isInt(string):
         return False
 
 
+#name and type of the 64 columns stored in every csv file, region name is appended as 65th column
+#integer codes use the narrowest type their values fit in, str columns are dictionary encoded
+SCHEMA = [
+    ("p1", np.int64), ("p36", np.int8), ("p37", np.int32), ("p2a", np.datetime64), ("weekday(p2a)", np.int8),
+    ("p2b", np.int16), ("p6", np.int8), ("p7", np.int8), ("p8", np.int8), ("p9", np.int8), ("p10", np.int8),
+    ("p11", np.int8), ("p12", np.int16), ("p13a", np.int32), ("p13b", np.int32), ("p13c", np.int32),
+    ("p14", np.int32), ("p15", np.int8), ("p16", np.int8), ("p17", np.int8), ("p18", np.int8), ("p19", np.int8),
+    ("p20", np.int8), ("p21", np.int8), ("p22", np.int8), ("p23", np.int8), ("p24", np.int8), ("p27", np.int8),
+    ("p28", np.int8), ("p34", np.int8), ("p35", np.int8), ("p39", np.int8), ("p44", np.int8), ("p45a", np.int8),
+    ("p47", np.int8), ("p48a", np.int8), ("p49", np.int8), ("p50a", np.int8), ("p50b", np.int8), ("p51", np.int8),
+    ("p52", np.int8), ("p53", np.int32), ("p55a", np.int8), ("p57", np.int8), ("p58", np.int8),
+    ("a", np.float64), ("b", np.float64), ("d", np.float64), ("e", np.float64), ("f", np.float64), ("g", np.float64),
+    ("h", str), ("i", str), ("j", str), ("k", str), ("l", str), ("n", str), ("o", np.float64), ("p", str),
+    ("q", str), ("r", np.int32), ("s", np.int32), ("t", str), ("p5a", np.int8),
+    ("region", str)
+]
+
+#names of all 65 parsed columns, used to select columns from cache
+COLUMNS = [name for name, _ in SCHEMA]
+HEADER = COLUMNS[:64]
+
+#csv file of every region inside of the downloaded zip archives
+REGIONS = {
+    "PHA": "00.csv",
+    "STC": "01.csv",
+    "JHC": "02.csv",
+    "PLK": "03.csv",
+    "KVK": "19.csv",
+    "ULK": "04.csv",
+    "LBK": "18.csv",
+    "HKK": "05.csv",
+    "PAK": "17.csv",
+    "OLK": "14.csv",
+    "MSK": "07.csv",
+    "JHM": "06.csv",
+    "ZLK": "15.csv",
+    "VYS": "16.csv"
+}
+
+#year and optional month of snapshot in archive name, e.g. datagis-09-2020.zip or datagis-rok-2016.zip
+ARCHIVE_NAME = re.compile(r"(?:(\d{2})-)?(\d{4})\.zip$")
+
+DATE_COLUMN = 3
+
+#version of cache format, cache written by other version is built again
+CACHE_VERSION = 2
+
+#coded columns with counts and casualty sums precomputed by region and day, stored next to every region cache
+ROLLUP_FIELDS = ["p5a", "p6", "p7", "p8", "p9", "p10", "p11", "p12", "p16", "p36"]
+ROLLUP_SUMS = ["p13a", "p13b", "p13c"]
+#version of rollup format, rollup written by other version is built again from cache
+ROLLUP_VERSION = 1
+
+def validMask(column, valid, check):
+    #values which did not match the fast pattern are checked once per unique value
+    rest = ~valid
+    if rest.any():
+        unique, inverse = np.unique(column[rest], return_inverse=True)
+        checked = np.array([check(value) for value in unique], dtype=bool)
+        valid[rest] = checked[inverse]
+    return valid
+
+def narrowInt(column, dtype):
+    #values outside of the schema type are kept in int64 instead of overflowing
+    info = np.iinfo(dtype)
+    if column.size and (column.min() < info.min or column.max() > info.max):
+        return column
+    return column.astype(dtype)
+
+def codeType(size):
+    #narrowest type for codes of dictionary with given size
+    for dtype in (np.int8, np.int16, np.int32):
+        if size <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+class DictColumn:
+    #dictionary encoded string column, codes index into array of categories
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def encode(cls, values):
+        #hash based factorization, categories are sorted like np.unique sorts them
+        codes, categories = pd.factorize(np.asarray(values, dtype=object), sort=True)
+        categories = np.asarray(categories, dtype=str)
+        return cls(codes.astype(codeType(categories.size)), categories)
+
+    @property
+    def size(self):
+        return self.codes.size
+
+    def __len__(self):
+        return self.codes.size
+
+    def __getitem__(self, index):
+        return DictColumn(np.asarray(self.codes[index]), self.categories)
+
+    def isin(self, values):
+        #values are compared only with categories, rows get the result through their codes
+        return np.isin(self.categories, values)[self.codes]
+
+    def decode(self):
+        return self.categories[self.codes]
+
+def mergeDictColumns(columns):
+    #categories are merged in order of first appearance, so codes of the first column stay valid
+    lookup = {}
+    mappings = []
+    for column in columns:
+        mappings.append(np.array([lookup.setdefault(value, len(lookup)) for value in column.categories.tolist()], dtype=np.int64))
+    codes = np.empty(sum(column.size for column in columns), dtype=codeType(len(lookup)))
+    position = 0
+    for column, mapping in zip(columns, mappings):
+        codes[position:position + column.size] = mapping[column.codes]
+        position += column.size
+    return DictColumn(codes, np.array(list(lookup), dtype=str))
+
+def decodeColumns(columns):
+    #dictionary encoded columns are turned back into plain string arrays
+    return [column.decode() if isinstance(column, DictColumn) else np.asarray(column) for column in columns]
+
+def parseColumn(index, values):
+    #values are strings split by csv parser, fixed width string array is made only for validation
+    values = np.asarray(values, dtype=object)
+    dtype = SCHEMA[index][1]
+    if dtype is str:
+        return DictColumn.encode(values)
+    #empty column only gets its dtype, there is nothing to validate
+    if values.size == 0:
+        return values.astype(str).astype(dtype)
+    if dtype is np.datetime64:
+        return values.astype(str).astype(np.datetime64)
+    elif dtype is np.float64:
+        column = np.char.replace(values.astype(str), ",", ".")
+        valid = np.char.isdecimal(np.char.replace(np.char.replace(column, "-", "", 1), ".", "", 1)) \
+            & (np.char.find(column, "-") <= 0)
+        valid = validMask(column, valid, isFloat)
+        return np.where(valid, column, "-1").astype(np.float64)
+    #column with only valid values is converted straight away, int64 conversion accepts the same strings as isInt
+    try:
+        return narrowInt(values.astype(np.int64), dtype)
+    except (ValueError, OverflowError):
+        pass
+    #optional leading minus followed by digits only
+    column = values.astype(str)
+    valid = np.char.isdecimal(np.char.replace(column, "-", "", 1)) & (np.char.find(column, "-") <= 0)
+    valid = validMask(column, valid, isInt)
+    #validated python strings are converted to int much faster than fixed width numpy strings
+    return narrowInt(np.where(valid, values, "-1").astype(np.int64), dtype)
+
+def parseCsv(content, region):
+    #whole csv member is split into columns by C parser of pandas, every value is kept as string
+    #and validated by parseColumn, fields after the 64th are ignored
+    if content.strip():
+        frame = pd.read_csv(BytesIO(content), sep=";", header=None, names=range(64), usecols=range(64), index_col=False,
+                            dtype=object, encoding="windows-1250", keep_default_na=False, na_filter=False)
+        values = [frame[i].to_numpy(dtype=object) for i in range(64)]
+    else:
+        values = [[] for _ in range(64)]
+    columns = [parseColumn(i, values[i]) for i in range(64)]
+    columns.append(DictColumn(np.zeros(len(values[0]), dtype=np.int8), np.array([region])))
+    return columns
+
+def parseArchive(path, region):
+    #parse csv file of one region from one zip archive
+    return parseArchiveRegions(path, [region])[region]
+
+def parseArchiveRegions(path, regions):
+    #open zip archive once and parse csv files of all given regions, used by worker processes as well
+    #stages measured in worker processes stay in the worker, parent measures whole parse_regions
+    parsed = {}
+    with zipfile.ZipFile(path, "r") as tempzip:
+        for region in regions:
+            with instrument.stage("unzip") as stage:
+                content = tempzip.read(REGIONS.get(region))
+                stage.add(bytes=len(content))
+            with instrument.stage("parse", bytes=len(content)) as stage:
+                parsed[region] = parseCsv(content, region)
+                stage.add(rows=parsed[region][0].size)
+    return parsed
+
+def emptyColumn(index):
+    #empty column with the same dtype as parsed one
+    return parseColumn(index, [])
+
+def mergeParts(parts, indexes=range(65)):
+    #join columns of separate archives or regions in the order of parts, parts contain columns from indexes
+    if not parts:
+        return [emptyColumn(i) for i in indexes]
+    #single part is returned as it is, so memory mapped cache is not copied at all
+    if len(parts) == 1:
+        return list(parts[0])
+    size = sum(part[0].size for part in parts)
+    merged = []
+    for i in range(len(parts[0])):
+        if isinstance(parts[0][i], DictColumn):
+            merged.append(mergeDictColumns([part[i] for part in parts]))
+            for part in parts:
+                part[i] = None
+            continue
+        #every column is allocated once at its final size and filled in place,
+        #column of every part is released right after copying to keep memory at about one copy of data
+        column = np.empty(size, dtype=np.result_type(*[part[i].dtype for part in parts]))
+        position = 0
+        for part in parts:
+            column[position:position + part[i].size] = part[i]
+            position += part[i].size
+            part[i] = None
+        merged.append(column)
+    return merged
+
+def archiveSources(archives):
+    #name, size and modification time of every archive, cache built from different archives is stale
+    sources = []
+    for archive in archives:
+        stat = os.stat(archive)
+        sources.append({"name": os.path.basename(archive), "size": stat.st_size, "mtime": stat.st_mtime_ns})
+    return sources
+
+def writeCache(folder, columns, sources):
+    #every column is stored as raw fixed width binary file, header.json describes their dtypes and row count
+    #together with manifest of archives the cache was built from
+    #files of rebuilt cache get names with number higher than the stored header uses, so columns memory
+    #mapped from the stored files keep their values and the header replace is the single commit point
+    os.makedirs(folder, exist_ok=True)
+    generation = cacheGeneration(folder) + 1
+    header = {"version": CACHE_VERSION, "rows": int(columns[0].size), "sources": sources, "columns": [],
+              "generation": generation}
+    with instrument.stage("cache_write", rows=header["rows"]) as stage:
+        for i, column in enumerate(columns):
+            filename = "{:02d}.{}.bin".format(i, generation)
+            entry = {"name": COLUMNS[i], "file": filename}
+            #dictionary encoded column stores its codes and categories in separate files
+            if isinstance(column, DictColumn):
+                entry["categories"] = writeCategories(folder, i, column.categories, generation)
+                column = column.codes
+            np.ascontiguousarray(column).tofile(os.path.join(folder, filename))
+            stage.add(bytes=column.nbytes)
+            entry["dtype"] = column.dtype.str
+            header["columns"].append(entry)
+    #header is written last, cache without it is considered missing
+    with open(os.path.join(folder, "header.json.tmp"), "w") as f:
+        json.dump(header, f)
+    os.replace(os.path.join(folder, "header.json.tmp"), os.path.join(folder, "header.json"))
+    removeUnused(folder, header)
+    #rollup is derived from cache, it is written after header and built again whenever its row count differs
+    writeRollup(folder, rollupColumns(dict(zip(COLUMNS, columns))), header["rows"])
+
+def cacheGeneration(folder):
+    #number of the last write of cache stored in folder, 0 when there is no readable header
+    try:
+        with open(os.path.join(folder, "header.json")) as f:
+            return json.load(f).get("generation", 0)
+    except (OSError, ValueError):
+        return 0
+
+def writeCategories(folder, index, categories, generation=0):
+    #categories get file named with number of the cache write, stored files are never overwritten
+    filename = "{:02d}.categories.bin".format(index) if generation == 0 else "{:02d}.{}.categories.bin".format(index, generation)
+    categories.tofile(os.path.join(folder, filename))
+    return {"dtype": categories.dtype.str, "size": int(categories.size), "file": filename}
+
+def readCategories(folder, entry):
+    return np.fromfile(os.path.join(folder, entry["file"]), dtype=entry["dtype"], count=entry["size"])
+
+def appendCache(folder, columns, sources):
+    #new rows are appended to the end of every column file, header with new row count is written last
+    with open(os.path.join(folder, "header.json")) as f:
+        header = json.load(f)
+    #rewritten files get names with number of this append, files of the stored header are never overwritten
+    generation = header.get("generation", 0) + 1
+    with instrument.stage("cache_append", rows=int(columns[0].size)) as stage:
+        for i, column in enumerate(columns):
+            if isinstance(column, DictColumn):
+                #new categories are added after the stored ones, so stored codes stay valid
+                categories = readCategories(folder, header["columns"][i]["categories"])
+                column = mergeDictColumns([DictColumn(np.empty(0, dtype=np.int8), categories), column])
+                if column.categories.size != categories.size or column.categories.dtype != categories.dtype:
+                    header["columns"][i]["categories"] = writeCategories(folder, i, column.categories, generation)
+                column = column.codes
+            filename = os.path.join(folder, header["columns"][i]["file"])
+            dtype = np.dtype(header["columns"][i]["dtype"])
+            newdtype = np.result_type(dtype, column.dtype)
+            if newdtype == dtype:
+                #bytes left after interrupted append are cut off first
+                os.truncate(filename, header["rows"] * dtype.itemsize)
+                with open(filename, "ab") as f:
+                    np.ascontiguousarray(column, dtype=dtype).tofile(f)
+            else:
+                #values which do not fit into the stored type need the whole column to be written again,
+                #it is written into new file, so the stored header keeps describing the stored file
+                old = np.fromfile(filename, dtype=dtype, count=header["rows"])
+                header["columns"][i]["file"] = "{:02d}.{}.bin".format(i, generation)
+                np.concatenate((old, column)).astype(newdtype).tofile(os.path.join(folder, header["columns"][i]["file"]))
+                header["columns"][i]["dtype"] = newdtype.str
+            stage.add(bytes=column.size * newdtype.itemsize)
+    rows = header["rows"]
+    header["rows"] += int(columns[0].size)
+    header["sources"] = sources
+    header["generation"] = generation
+    #header replace is the single point the append is committed at, files it no longer refers to are removed after it
+    with open(os.path.join(folder, "header.json.tmp"), "w") as f:
+        json.dump(header, f)
+    os.replace(os.path.join(folder, "header.json.tmp"), os.path.join(folder, "header.json"))
+    removeUnused(folder, header)
+    #rollup of appended rows is added to stored rollup, when it does not match the rows before append it is built again
+    stored = readRollup(folder)
+    if stored is not None and stored[0] == rows:
+        writeRollup(folder, mergeRollups(stored[1], rollupColumns(dict(zip(COLUMNS, columns)))), header["rows"])
+    else:
+        loadRollup(folder)
+
+def archiveVersion(filename):
+    #(year, month) of archive snapshot, archive of whole year is newer than any of its monthly snapshots
+    match = ARCHIVE_NAME.search(os.path.basename(filename))
+    if match == None:
+        return None
+    return (int(match.group(2)), int(match.group(1)) if match.group(1) else 13)
+
+def newestArchives(archives):
+    #monthly snapshots are cumulative, so only the newest archive of every year is used
+    newest = {}
+    for archive in archives:
+        version = archiveVersion(archive)
+        if version != None and (version[0] not in newest or version > archiveVersion(newest[version[0]])):
+            newest[version[0]] = archive
+    return [archive for archive in archives if archiveVersion(archive) == None or newest[archiveVersion(archive)[0]] == archive]
+
+def firstOccurrence(ids):
+    #mask of first row of every accident id, rows with invalid id -1 are always kept
+    _, first = np.unique(ids, return_index=True)
+    mask = np.zeros(ids.size, dtype=bool)
+    mask[first] = True
+    mask |= ids == -1
+    return mask
+
+def dedupeColumns(columns):
+    #every accident is kept only once, in the order of its first occurrence
+    mask = firstOccurrence(columns[0])
+    if mask.all():
+        return columns
+    return [column[mask] for column in columns]
+
+def changedSources(cached, sources):
+    #indexes of archives which are new or changed since cache was built,
+    #None when cache is missing or some archive was removed and cache has to be built again
+    if cached == None:
+        return None
+    names = set(source["name"] for source in sources)
+    versions = [archiveVersion(source["name"]) for source in sources]
+    for source in cached:
+        #archive replaced by newer snapshot of the same year does not need rebuild, the snapshot contains its records
+        version = archiveVersion(source["name"])
+        superseded = version != None and any(other != None and other[0] == version[0] and other > version for other in versions)
+        if source["name"] not in names and not superseded:
+            return None
+    return [i for i, source in enumerate(sources) if source not in cached]
+
+def removeUnused(folder, header):
+    #removes column files left by earlier appends or by interrupted ones, header does not refer to them
+    used = set()
+    for entry in header["columns"]:
+        used.add(entry["file"])
+        if "categories" in entry:
+            used.add(entry["categories"]["file"])
+    for name in os.listdir(folder):
+        if name.endswith(".bin") and name not in used:
+            try:
+                os.remove(os.path.join(folder, name))
+            except OSError:
+                pass
+
+def cacheSources(folder):
+    #manifest of archives stored in cache, None when there is no usable cache
+    try:
+        with open(os.path.join(folder, "header.json")) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if header.get("version") != CACHE_VERSION:
+        return None
+    return header["sources"]
+
+def readCache(folder, indexes=range(65)):
+    #columns are only memory mapped, data is read from disk when they are accessed
+    with open(os.path.join(folder, "header.json")) as f:
+        header = json.load(f)
+    columns = []
+    #bytes of stage are bytes mapped, they are read later when columns are used
+    with instrument.stage("cache_read", rows=header["rows"]) as stage:
+        for i in indexes:
+            entry = header["columns"][i]
+            if header["rows"] == 0:
+                column = np.empty(0, dtype=entry["dtype"])
+            else:
+                column = np.memmap(os.path.join(folder, entry["file"]), dtype=entry["dtype"], mode="r",
+                                   shape=(header["rows"],))
+            stage.add(bytes=column.nbytes)
+            if "categories" in entry:
+                column = DictColumn(column, readCategories(folder, entry["categories"]))
+            columns.append(column)
+    return columns
+
+
+def groupRollup(days, values, sums, counts=None):
+    #counts and sums of rows grouped by (day, value), counts are given when already grouped rows are grouped again
+    keys = days.astype(np.int64) * (1 << 32) + (values.astype(np.int64) + (1 << 31))
+    unique, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    entry = {"day": unique // (1 << 32), "value": unique % (1 << 32) - (1 << 31),
+             "count": np.bincount(inverse, weights=counts, minlength=unique.size).astype(np.int64)}
+    for name, column in zip(ROLLUP_SUMS, sums):
+        entry[name] = np.bincount(inverse, weights=column, minlength=unique.size).astype(np.int64)
+    return entry
+
+def rollupColumns(columns):
+    #rollup of every field from dict of column name and column, field "" groups by day only
+    days = np.asarray(columns["p2a"]).astype("datetime64[D]").astype(np.int64)
+    sums = [np.asarray(columns[name]) for name in ROLLUP_SUMS]
+    rollup = {}
+    for field in [""] + ROLLUP_FIELDS:
+        values = np.asarray(columns[field]) if field else np.zeros(days.size, dtype=np.int64)
+        rollup[field] = groupRollup(days, values, sums)
+    return rollup
+
+def mergeRollups(first, second):
+    #rollups of separate rows are joined and groups present in both are summed
+    merged = {}
+    for field in first:
+        joined = {name: np.concatenate((first[field][name], second[field][name])) for name in first[field]}
+        merged[field] = groupRollup(joined["day"], joined["value"], [joined[name] for name in ROLLUP_SUMS], joined["count"])
+    return merged
+
+def writeRollup(folder, rollup, rows):
+    #all fields are stored in single npz file together with row count of cache they were computed from
+    arrays = {"{}:{}".format(field, name): array for field, entry in rollup.items() for name, array in entry.items()}
+    with open(os.path.join(folder, "rollup.npz.tmp"), "wb") as f:
+        np.savez(f, rows=rows, version=ROLLUP_VERSION, **arrays)
+    os.replace(os.path.join(folder, "rollup.npz.tmp"), os.path.join(folder, "rollup.npz"))
+
+def readRollup(folder, fields=None):
+    #returns (rows, rollup) stored in folder, None when it is missing or written by other version
+    #only given fields are read, None reads all of them
+    try:
+        with np.load(os.path.join(folder, "rollup.npz")) as stored:
+            if int(stored["version"]) != ROLLUP_VERSION:
+                return None
+            rollup = {}
+            for key in stored.files:
+                if ":" in key:
+                    field, name = key.split(":")
+                    if fields is None or field in fields:
+                        rollup.setdefault(field, {})[name] = stored[key]
+            return int(stored["rows"]), rollup
+    except (OSError, KeyError, ValueError):
+        return None
+
+def loadRollup(folder, fields=None):
+    #rollup of region cache, it is built again from cached columns when it is missing or does not match the cache
+    with open(os.path.join(folder, "header.json")) as f:
+        rows = json.load(f)["rows"]
+    stored = readRollup(folder, fields)
+    if stored is not None and stored[0] == rows:
+        return stored[1]
+    names = ["p2a"] + ROLLUP_SUMS + ROLLUP_FIELDS
+    rollup = rollupColumns(dict(zip(names, readCache(folder, [COLUMNS.index(name) for name in names]))))
+    writeRollup(folder, rollup, rows)
+    return rollup
+
+
+#default memory budget of one batch of streamed columns in bytes
+BATCH_BUDGET = 64 * 1024 * 1024
+
+def batchRows(indexes, budget, decode):
+    #count of rows fitting into budget, decoded strings are estimated at 32 bytes, dictionary codes at 4 bytes
+    rowbytes = 0
+    for i in indexes:
+        dtype = SCHEMA[i][1]
+        rowbytes += (32 if decode else 4) if dtype is str else np.dtype(dtype).itemsize
+    return max(1, budget // max(1, rowbytes))
+
+def groupIndex(column):
+    #unique values of column and index of value of every row, dictionary codes are grouped without decoding
+    values = column.codes if isinstance(column, DictColumn) else column
+    unique, inverse = np.unique(values, return_inverse=True)
+    if isinstance(column, DictColumn):
+        unique = column.categories[unique]
+    return unique, inverse.reshape(-1)
+
+class DownloadState:
+    #ETag and Last-Modified of downloaded archives and of partially downloaded ones, shared by download threads
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = Lock()
+        try:
+            with open(filename) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def set(self, key, value):
+        #state is saved after every change, so validators of partial files survive interrupted run
+        with self.lock:
+            if value == None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+            with open(self.filename + ".tmp", "w") as f:
+                json.dump(self.data, f)
+            os.replace(self.filename + ".tmp", self.filename)
+
+def responseValidators(response):
+    return {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+
+def downloadFile(session, url, filename, state):
+    #conditional download of url into filename, partial file is resumed with Range request
+    #data are written into temporary .part file which is renamed when complete
+    name = os.path.basename(filename)
+    part = filename + ".part"
+    headers = {}
+
+    validators = state.get(name)
+    if validators and os.path.isfile(filename):
+        if validators["etag"]:
+            headers["If-None-Match"] = validators["etag"]
+        if validators["last_modified"]:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+    #partial file is resumed only when it is still the same version on the server
+    partvalidators = state.get(name + ".part")
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+    if offset and partvalidators and (partvalidators["etag"] or partvalidators["last_modified"]):
+        headers["Range"] = "bytes={}-".format(offset)
+        headers["If-Range"] = partvalidators["etag"] or partvalidators["last_modified"]
+
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return None
+        if response.status_code == 416 and offset:
+            #partial file is not usable, download whole file again
+            os.remove(part)
+            state.set(name + ".part", None)
+            return downloadFile(session, url, filename, state)
+        response.raise_for_status()
+
+        mode = "ab" if response.status_code == 206 else "wb"
+        if mode == "wb":
+            state.set(name + ".part", responseValidators(response))
+        with open(part, mode) as f, instrument.stage("download") as stage:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+                stage.add(bytes=len(chunk))
+
+    os.replace(part, filename)
+    state.set(name, state.get(name + ".part") or responseValidators(response))
+    state.set(name + ".part", None)
+    return filename
+
+
 class  DataDownloader:
 
 
      
-    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/",folder="data", cache_filename="data_{}.pkl.gz"):
+    def __init__(self, url="https://ehw.fit.vutbr.cz/izv/",folder="data", cache_filename="data_{}", incremental=True):
         self.url = url
         self.folder = folder
         self.cache_filename = cache_filename
+        #when True, records of new or changed archives are appended to existing cache instead of rebuilding it
+        self.incremental = incremental
 
-    def download_data(self):
-        r = requests.get(self.url, stream=True, headers={"User-Agent":"Mozilla/5.0"})
+    @instrument.traced("download_data", rows=len)
+    def download_data(self, workers = 4):
+        #one session with connection pool large enough for all concurrent transfers
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["User-Agent"] = "Mozilla/5.0"
+
+        r = session.get(self.url)
         soup = BeautifulSoup(r.content, 'html.parser')
         b = soup.find_all('a', class_='btn btn-sm btn-primary', href=True)
         b.reverse()
@@ -43,129 +622,292 @@ class  DataDownloader:
         if not os.path.exists(self.folder):
             os.mkdir(self.folder)
 
+        #only newest archive of every year is downloaded
+        hrefs = []
         for a in b:
             if newestflag == True:
-                re = requests.get(self.url + a['href'])
-                with open(a['href'],'wb') as f:
-                   for chunk in re.iter_content(chunk_size=128):
-                       if chunk:
-                         f.write(chunk)
-                   newestflag = False
+                hrefs.append(a['href'])
+                newestflag = False
             elif a['href'].find("01-") != -1:
                 newestflag = True
 
+        state = DownloadState(os.path.join(self.folder, "downloads.json"))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            downloaded = list(executor.map(lambda href: downloadFile(session, self.url + href,
+                os.path.join(self.folder, os.path.basename(href)), state), hrefs))
+        #paths of archives which were downloaded, unchanged archives are skipped
+        return [path for path in downloaded if path is not None]
+
+    def archives(self):
+        #newest zip archive of every year from data folder, sorted so every run merges them in the same order
+        return newestArchives([self.folder + '/' + filename for filename in sorted(os.listdir(self.folder)) if filename.endswith(".zip")])
+
     def parse_region_data(self, region):
-        regiondict = {
-            "PHA": "00.csv",
-            "STC": "01.csv",
-            "JHC": "02.csv",
-            "PLK": "03.csv",
-            "KVK": "19.csv",
-            "ULK": "04.csv",
-            "LBK": "18.csv",
-            "HKK": "05.csv",
-            "PAK": "17.csv",
-            "OLK": "14.csv",
-            "MSK": "07.csv",
-            "JHM": "06.csv",
-            "ZLK": "15.csv",
-            "VYS": "16.csv"
-        }
-
-        header = ["p1","p36","p37","p2a","weekday(p2a)","p2b","p6","p7","p8","p9","p10","p11","p12","p13a",
-        "p13b","p13c","p14","p15","p16","p17","p18","p19","p20","p21","p22","p23","p24","p27","p28","p34",
-        "p35","p39","p44","p45a","p47","p48a","p49","p50a","p50b","p51","p52","p53","p55a","p57","p58","a",
-        "b","d","e","f","g","h","i","j","k","l","n","o","p","q","r","s","t","p5a"]
-
-
-        templist = [[] for _ in range(65)]
-        finallist = [[] for _ in range(65)]
-
-        for filename in os.listdir(self.folder):
-            if filename.endswith(".zip"):
-                tempzip = zipfile.ZipFile(self.folder + '/' + filename,"r")
-
-                with tempzip.open(regiondict.get(region), 'r') as f:
-                    reader = csv.reader(TextIOWrapper(f,"windows-1250"), delimiter=";")
-                    for row in reader:
-                        for i in range(64):
-                            if i in range(0,3) or i in range(4,45) or i in range(60,62) or i == 63:
-                                #int
-                                if isInt(row[i]):
-                                    templist[i].append(row[i])
-                                else:
-                                    templist[i].append('-1')
-
-                            elif i == 3:
-                                #date
-                                templist[i].append(row[i])
-
-                            elif i in range(45,51) or i == 57:
-                                #float
-                                tempvar = row[i].replace(',','.')
-                                if isFloat(tempvar):
-                                    templist[i].append(tempvar)
-                                else:
-                                    templist[i].append("-1")
-
-                            elif i in range(51,57) or i in range(59,60) or i == 62:
-                                #string
-                                templist[i].append(row[i])
-                                
-                        templist[64].append(region)
-       
-        for i in range(65):
-                           if i in range(0,3) or i in range(4,45) or i in range(60,62) or i == 63:
-                                #int
-                                finallist[i] = np.array(templist[i], dtype=np.int64)
-                           elif i == 3:
-                                #date
-                                finallist[i] = np.array(templist[i], dtype=np.datetime64)
-                           elif i in range(45,51) or i == 57:
-                                #float
-                                finallist[i] = np.array(templist[i], dtype=np.float64)
-                           elif i in range(51,57) or i in range(58,60) or i == 62 or i == 64:
-                                #string
-                                finallist[i] = np.array(templist[i])
-
-        regiontuple = (header,finallist)
+        parts = [parseArchive(path, region) for path in self.archives()]
+        regiontuple = (list(HEADER),decodeColumns(dedupeColumns(mergeParts(parts))))
         return regiontuple
 
-    def get_list(self, regions = None):
+    @instrument.traced("parse_regions", rows=lambda parsed: sum(columns[1][0].size for columns in parsed.values()))
+    def parse_regions(self, regions, workers=None, archives=None):
+        #every archive is opened only once and all regions are read from it in one pass
+        if archives == None:
+            archives = self.archives()
+        if workers:
+            #split regions into groups so there is enough (archive, regions) tasks for all workers
+            groupcount = min(len(regions), max(1, -(-workers // max(1, len(archives)))))
+            groups = [regions[i::groupcount] for i in range(groupcount)]
+            tasks = [(path, group) for path in archives for group in groups]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(parseArchiveRegions, [path for path, _ in tasks], [group for _, group in tasks]))
+            #join results of region groups back into one result per archive
+            merged = [{} for _ in archives]
+            for index, result in enumerate(results):
+                merged[index // groupcount].update(result)
+            results = merged
+        else:
+            results = [parseArchiveRegions(path, regions) for path in archives]
+
+        parsed = {}
+        for region in regions:
+            parsed[region] = (list(HEADER),dedupeColumns(mergeParts([result[region] for result in results])))
+        return parsed
+
+    def build_cache(self, regions = None, workers = None, archives = None):
+        #parse all regions in single scan over archives and store every one of them into cache
+        if regions == None:
+            regions = list(REGIONS)
+        if archives == None:
+            archives = self.archives()
+        #archives are fingerprinted before parsing, so cache is never newer than its manifest
+        sources = archiveSources(archives)
+        parsed = self.parse_regions(regions, workers, archives)
+        for region in regions:
+            writeCache(self.cache_filename.format(region), parsed[region][1], sources)
+        return parsed
+
+    def append_cache(self, regions, archives, sources, workers = None):
+        #parse only given archives and append records with accident id p1 not yet present in cache
+        parsed = self.parse_regions(regions, workers, archives)
+        for region in regions:
+            folder = self.cache_filename.format(region)
+            columns = parsed[region][1]
+            #first occurrence of every id is kept when more new archives contain the same record
+            keep = firstOccurrence(columns[0])
+            #rows with invalid id -1 can not be matched with cached ones, they are always appended like rebuild keeps them
+            keep &= (columns[0] == -1) | np.isin(columns[0], readCache(folder, [0])[0], invert=True)
+            appendCache(folder, [column[keep] for column in columns], sources)
+
+    def update_cache(self, regions, workers = None):
+        #regions missing in cache or built from different archives are parsed together in single scan over archives,
+        #in parallel when workers are set
+        archives = self.archives()
+        sources = archiveSources(archives)
+        rebuild = []
+        append = {}
+        for region in regions:
+            cached = cacheSources(self.cache_filename.format(region))
+            if cached == sources:
+                continue
+            changed = changedSources(cached, sources) if self.incremental else None
+            if changed == None:
+                rebuild.append(region)
+            else:
+                #regions with the same changed archives are appended together
+                append.setdefault(tuple(changed), []).append(region)
+
+        for changed, group in append.items():
+            self.append_cache(group, [archives[i] for i in changed], sources, workers)
+        if rebuild:
+            return self.build_cache(rebuild, workers, archives)
+        return {}
+
+    def fingerprint(self, regions = None):
+        #hash of cache headers of given regions, it changes whenever any of their caches is rebuilt or appended
+        if regions == None:
+            regions = list(REGIONS)
+        sha = hashlib.sha1()
+        for region in regions:
+            with open(os.path.join(self.cache_filename.format(region), "header.json"), "rb") as f:
+                sha.update(f.read())
+        return sha.hexdigest()
+
+    @instrument.traced("get_list", rows=lambda result: len(result[1][0]) if result[1] else 0)
+    def get_list(self, regions = None, workers = None, columns = None, decode = True):
         #if none regions were specified, every region is used
         if regions == None:
-            regions = ["PHA","STC","JHC","PLK","KVK","ULK","LBK","HKK","PAK","OLK","MSK","JHM","ZLK","VYS"]
+            regions = list(REGIONS)
+        #if none columns were specified, every column is loaded
+        if columns == None:
+            header = list(HEADER)
+            indexes = range(65)
+        else:
+            header = list(columns)
+            indexes = [COLUMNS.index(column) for column in columns]
+
+        parsed = self.update_cache(regions, workers)
 
-        header = ["p1","p36","p37","p2a","weekday(p2a)","p2b","p6","p7","p8","p9","p10","p11","p12","p13a",
-        "p13b","p13c","p14","p15","p16","p17","p18","p19","p20","p21","p22","p23","p24","p27","p28","p34",
-        "p35","p39","p44","p45a","p47","p48a","p49","p50a","p50b","p51","p52","p53","p55a","p57","p58","a",
-        "b","d","e","f","g","h","i","j","k","l","n","o","p","q","r","s","t","p5a"]
-        lists = [[] for _ in range(65)]
-        finaltuple = (header,lists)
+        parts = []
+        for region in regions:
+            #regions which were just parsed are already stored in cache
+            if region in parsed:
+                temptuple = parsed.pop(region)
+                parts.append([temptuple[1][i] for i in indexes])
+            #otherwise map only selected columns of region from its cache
+            else:
+                parts.append(readCache(self.cache_filename.format(region), indexes))
+
+        #row counts of all regions are known now, so every column is merged only once
+        #string columns stay dictionary encoded as DictColumn unless decode is True
+        rows = sum(len(part[0]) for part in parts)
+        with instrument.stage("concat", rows=rows):
+            finaltuple = (header,mergeParts(parts, indexes))
+        if decode:
+            with instrument.stage("decode", rows=rows):
+                finaltuple = (header,decodeColumns(finaltuple[1]))
+
+        print(finaltuple[1][0].size if finaltuple[1] else 0)
+        return finaltuple
+
+
+    def iter_batches(self, columns = None, regions = None, memory_budget = BATCH_BUDGET, batch_rows = None, workers = None, decode = True):
+        #yields (header, columns) batches of batch_rows rows (last one may be shorter) over all regions in their order,
+        #batch size is derived from memory_budget unless batch_rows is set
+        #regions are brought up to date in cache one by one and batches are cut from memory mapped cache,
+        #so only one region is parsed and only one batch is materialized at once
+        if regions == None:
+            regions = list(REGIONS)
+        if columns == None:
+            columns = list(HEADER)
+        indexes = [COLUMNS.index(column) for column in columns]
+        if batch_rows == None:
+            batch_rows = batchRows(indexes, memory_budget, decode)
 
+        pending = []
+        count = 0
         for region in regions:
-            #if cache file for current region already exists load from cache
-            if os.path.isfile(self.cache_filename.format(region)):
-                with open(self.cache_filename.format(region),'rb') as f:
-                    temptuple = pickle.load(f)
-            #if it doesnt, parse zipfiles from data folder and load it into cache
-            else: 
-                temptuple = self.parse_region_data(region)
-                with open(self.cache_filename.format(region),'wb') as f:
-                    pickle.dump(temptuple, f)
-
-            #append current region from regions into final tuple
-            for i in range(65):
-                if i == 3:
-                    try:
-                        finaltuple[1][i] = np.concatenate((finaltuple[1][i],temptuple[1][i]), axis=None)
-                    except TypeError:
-                       finaltuple[1][i] = np.array(temptuple[1][i], dtype=np.datetime64) 
+            self.update_cache([region], workers)
+            regioncolumns = readCache(self.cache_filename.format(region), indexes)
+            size = len(regioncolumns[0])
+            start = 0
+            while start < size:
+                take = min(batch_rows - count, size - start)
+                pending.append([column[start:start + take] for column in regioncolumns])
+                count += take
+                start += take
+                if count == batch_rows:
+                    merged = mergeParts(pending, indexes)
+                    yield (list(columns),decodeColumns(merged) if decode else merged)
+                    pending = []
+                    count = 0
+        if pending:
+            merged = mergeParts(pending, indexes)
+            yield (list(columns),decodeColumns(merged) if decode else merged)
+
+    def aggregate(self, by, sums = None, regions = None, transform = None, memory_budget = BATCH_BUDGET, workers = None):
+        #streaming group-by over iter_batches, counts rows and sums columns for every combination of values of by columns
+        #transform is dict of column name and function applied to the column of every batch before grouping,
+        #e.g. {"p2a": lambda dates: dates.astype("datetime64[Y]")}
+        #returns (header, columns) with by columns, "count" and sums columns, groups are in order of their first appearance
+        by = list(by)
+        sums = list(sums or [])
+        transform = transform or {}
+        groups = {}
+        for _, batch in self.iter_batches(by + sums, regions, memory_budget, workers = workers, decode = False):
+            keys = []
+            inverses = []
+            for name, column in zip(by, batch[:len(by)]):
+                unique, inverse = groupIndex(transform[name](column) if name in transform else column)
+                keys.append(unique)
+                inverses.append(inverse)
+            size = len(batch[0])
+            ids = np.ravel_multi_index(inverses, [len(unique) for unique in keys]) if by else np.zeros(size, dtype=np.int64)
+            groupids, first, inverse = np.unique(ids, return_index=True, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            totals = [np.bincount(inverse, minlength=groupids.size)]
+            for column in batch[len(by):]:
+                total = np.bincount(inverse, weights=column, minlength=groupids.size)
+                totals.append(total.astype(np.int64) if np.issubdtype(column.dtype, np.integer) else total)
+            #groups of every batch are visited in order of their first row, so dict keeps order of first appearance
+            for group in np.argsort(first, kind="stable"):
+                position = np.unravel_index(groupids[group], [len(unique) for unique in keys]) if by else ()
+                key = tuple(unique[i] for unique, i in zip(keys, position))
+                values = [total[group] for total in totals]
+                if key in groups:
+                    groups[key] = [a + b for a, b in zip(groups[key], values)]
                 else:
-                    finaltuple[1][i] = np.concatenate((finaltuple[1][i],temptuple[1][i]), axis=None)
+                    groups[key] = values
+
+        header = by + ["count"] + sums
+        columns = [np.array([key[i] for key in groups]) for i in range(len(by))]
+        columns += [np.array([values[i] for values in groups.values()]) for i in range(1 + len(sums))]
+        return (header,columns)
+
+    def rollup(self, field = None, regions = None, period = "D", workers = None):
+        #counts and p13a/p13b/p13c sums by region, period of p2a and value of field, read from rollup store of cache
+        #field None counts by period only, period is "D", "M" or "Y" and coarser periods are summed from days
+        #returns (header, columns) with columns region, p2a, field (unless None), count and sums
+        if regions == None:
+            regions = list(REGIONS)
+        if field is not None and field not in ROLLUP_FIELDS:
+            raise ValueError("{} is not in ROLLUP_FIELDS".format(field))
+        self.update_cache(regions, workers)
+
+        parts = []
+        for region in regions:
+            entry = loadRollup(self.cache_filename.format(region), [field or ""])[field or ""]
+            if period != "D":
+                periods = entry["day"].astype("datetime64[D]").astype("datetime64[{}]".format(period)).astype(np.int64)
+                entry = groupRollup(periods, entry["value"], [entry[name] for name in ROLLUP_SUMS], entry["count"])
+            columns = [np.full(entry["day"].size, region), entry["day"].astype("datetime64[{}]".format(period))]
+            if field is not None:
+                columns.append(entry["value"])
+            parts.append(columns + [entry["count"]] + [entry[name] for name in ROLLUP_SUMS])
+
+        header = ["region", "p2a"] + ([field] if field is not None else []) + ["count"] + ROLLUP_SUMS
+        if not parts:
+            return (header,[np.empty(0) for _ in header])
+        return (header,[np.concatenate(column) for column in zip(*parts)])
+
+    @instrument.traced("query", rows=lambda result: len(result[1][0]) if result[1] else 0)
+    def query(self, columns = None, regions = None, date_range = None, where = None, workers = None, decode = True):
+        #loads only selected columns and rows matching all filters, rows are filtered separately in every region cache
+        #date_range is (start, end) tuple of p2a dates where end is excluded, None means unbounded
+        #where is dict of column name and value or list of values the column has to be equal to
+        if regions == None:
+            regions = list(REGIONS)
+        if columns == None:
+            columns = list(COLUMNS)
+        where = dict(where or {})
+        indexes = [COLUMNS.index(column) for column in columns]
+        #filter on region only decides which region caches are opened
+        if "region" in where:
+            selected = where.pop("region")
+            regions = [region for region in regions if np.isin(region, selected)]
+
+        parsed = self.update_cache(regions, workers)
+
+        parts = []
+        for region in regions:
+            if region in parsed:
+                regioncolumns = parsed.pop(region)[1]
+            else:
+                regioncolumns = readCache(self.cache_filename.format(region))
 
-        print(finaltuple[1][0].size)
-        return finaltuple 
+            #filter columns are read first and only matching rows of selected columns are materialized
+            mask = np.ones(regioncolumns[0].size, dtype=bool)
+            if date_range is not None:
+                start, end = date_range
+                if start is not None:
+                    mask &= regioncolumns[DATE_COLUMN] >= np.datetime64(start)
+                if end is not None:
+                    mask &= regioncolumns[DATE_COLUMN] < np.datetime64(end)
+            for column, value in where.items():
+                column = regioncolumns[COLUMNS.index(column)]
+                mask &= column.isin(value) if isinstance(column, DictColumn) else np.isin(column, value)
 
+            selected = np.flatnonzero(mask)
+            parts.append([regioncolumns[i][selected] for i in indexes])
 
+        merged = mergeParts(parts, indexes)
+        return (list(columns),decodeColumns(merged) if decode else merged)
 
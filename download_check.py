@@ -0,0 +1,193 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from download import DataDownloader, DownloadState
+
+#fixture archives in order of the IZV index page, every year has monthly snapshots 01 ... 03
+NAMES = ["datagis-{:02d}-{}.zip".format(month, year) for year in (2019, 2020) for month in (1, 2, 3)]
+#archives download_data takes from the page, the newest snapshot of every year
+NEWEST = ["datagis-03-2019.zip", "datagis-03-2020.zip"]
+
+
+def make_archive(seed: int, size: int = 256 * 1024) -> bytes:
+    """[Returns zip archive with one stored member of random bytes, so its size is predictable]"""
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("00.csv", np.random.default_rng(seed).bytes(size))
+    return data.getvalue()
+
+
+class Server:
+    """[Local HTTP server with fixture index page and archives, answers conditional and range requests
+    like the IZV site and records status of every archive request]
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.log = []
+        self.version = 0
+        for seed, name in enumerate(NAMES):
+            self.put(name, make_archive(seed))
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=b"", headers=()):
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                name = self.path.lstrip("/")
+                if name == "":
+                    links = "".join('<a class="btn btn-sm btn-primary" href="{}">ZIP</a>'.format(name) for name in NAMES)
+                    return self.send(200, "<html><body>{}</body></html>".format(links).encode())
+                if name not in server.files:
+                    return self.send(404)
+                data, etag, modified = server.files[name]
+                validators = (("ETag", etag), ("Last-Modified", modified))
+                status = self.status(data, etag, modified)
+                server.log.append((name, status, "Range" in self.headers))
+                if status == 304:
+                    return self.send(304, headers=validators)
+                if status == 416:
+                    return self.send(416, headers=(("Content-Range", "bytes */{}".format(len(data))),))
+                if status == 206:
+                    start = int(self.headers["Range"][len("bytes="):].split("-")[0])
+                    return self.send(206, data[start:], validators + (
+                        ("Content-Range", "bytes {}-{}/{}".format(start, len(data) - 1, len(data))),))
+                return self.send(200, data, validators)
+
+            def status(self, data, etag, modified):
+                if self.headers.get("If-None-Match") == etag or (
+                        "If-None-Match" not in self.headers and self.headers.get("If-Modified-Since") == modified):
+                    return 304
+                requested = self.headers.get("Range")
+                if requested is None or self.headers.get("If-Range", etag) not in (etag, modified):
+                    return 200
+                if int(requested[len("bytes="):].split("-")[0]) >= len(data):
+                    return 416
+                return 206
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def put(self, name: str, data: bytes):
+        """[Publishes new version of archive, it gets new ETag and Last-Modified]"""
+        self.version += 1
+        self.files[name] = (data, '"{}-{}"'.format(name, self.version), formatdate(1600000000 + self.version, usegmt=True))
+
+    def statuses(self) -> list:
+        """[Returns statuses of archive requests since the last call, sorted by archive name]"""
+        log, self.log = sorted(self.log), []
+        return log
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        return False
+
+
+def run(folder: str) -> list:
+    """[Downloads fixture archives from local server through every path of download_data
+
+    Args:
+        folder (str): [Folder archives are downloaded into]
+
+    Returns:
+        list: [Names of failed checks, empty when all checks passed]
+    """
+    failures = []
+
+    def check(name, condition):
+        print("{:40} {}".format(name, "ok" if condition else "FAILED"))
+        if not condition:
+            failures.append(name)
+
+    def same(server):
+        return all(open(os.path.join(folder, name), "rb").read() == server.files[name][0] for name in NEWEST)
+
+    def interrupt(data, validators):
+        #state left by download of the first archive interrupted after len(data) bytes
+        os.remove(os.path.join(folder, NEWEST[0]))
+        with open(os.path.join(folder, NEWEST[0] + ".part"), "wb") as f:
+            f.write(data)
+        state = DownloadState(os.path.join(folder, "downloads.json"))
+        state.set(NEWEST[0], None)
+        state.set(NEWEST[0] + ".part", {"etag": validators[1], "last_modified": validators[2]})
+
+    with Server() as server:
+        downloader = DataDownloader(url=server.url, folder=folder)
+        part = os.path.join(folder, NEWEST[0] + ".part")
+
+        downloaded = downloader.download_data()
+        check("first run downloads newest archives", sorted(map(os.path.basename, downloaded)) == NEWEST
+              and server.statuses() == [(name, 200, False) for name in NEWEST] and same(server))
+
+        downloaded = downloader.download_data()
+        check("second run is not modified", downloaded == []
+              and server.statuses() == [(name, 304, False) for name in NEWEST])
+
+        #interrupted download leaves first half of archive in .part file with validators of its response
+        data = server.files[NEWEST[0]][0]
+        interrupt(data[:len(data) // 2], server.files[NEWEST[0]])
+        downloaded = downloader.download_data()
+        check("partial archive is resumed", list(map(os.path.basename, downloaded)) == NEWEST[:1]
+              and server.statuses() == [(NEWEST[0], 206, True), (NEWEST[1], 304, False)]
+              and same(server) and not os.path.exists(part))
+
+        #partial file as long as the archive asks for range the server can not satisfy
+        interrupt(data, server.files[NEWEST[0]])
+        downloader.download_data()
+        check("unsatisfiable range downloads again", server.statuses()
+              == [(NEWEST[0], 200, False), (NEWEST[0], 416, True), (NEWEST[1], 304, False)] and same(server))
+
+        #archive changed on the server after the partial file was downloaded, If-Range does not match
+        interrupt(data[:len(data) // 2], server.files[NEWEST[0]])
+        server.put(NEWEST[0], make_archive(100))
+        downloader.download_data()
+        check("changed archive is not resumed", server.statuses()
+              == [(NEWEST[0], 200, True), (NEWEST[1], 304, False)] and same(server))
+
+        server.put(NEWEST[1], make_archive(101))
+        downloaded = downloader.download_data()
+        check("changed archive is downloaded again", list(map(os.path.basename, downloaded)) == NEWEST[1:]
+              and server.statuses() == [(NEWEST[0], 304, False), (NEWEST[1], 200, False)] and same(server))
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks download_data against local server with fixture archives")
+    parser.add_argument("--folder", default=None, help="download folder, temporary folder by default")
+    args = parser.parse_args()
+
+    folder = args.folder or tempfile.mkdtemp(prefix="izv-download-")
+    try:
+        failures = run(folder)
+    finally:
+        if args.folder is None:
+            shutil.rmtree(folder, ignore_errors=True)
+    sys.exit(1 if failures else 0)
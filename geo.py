@@ -3,38 +3,85 @@
 import pandas as pd
 import geopandas
 import matplotlib.pyplot as plt
-import contextily as ctx
 import sklearn.cluster
 import numpy as np
 # muzeze pridat vlastni knihovny
+import memo
+import instrument
+import tiles
 
 
 
-def make_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
-    """[Converts DataFrame into geoDataFrame, excludes invalid items]
+#coordinate reference system of columns d and e (S-JTSK)
+CRS = "EPSG:5514"
+#columns needed by plots in this module, make_geo(df, GEO_COLUMNS, lazy=True) keeps only them
+GEO_COLUMNS = ("region", "p5a")
+
+
+@instrument.traced("make_geo")
+def make_geo(df: pd.DataFrame, columns: tuple = None, lazy: bool = False) -> geopandas.GeoDataFrame:
+    """[Converts DataFrame into geoDataFrame, excludes invalid items
+
+    Plots need only a few columns and geometry of plotted subsets, make_geo(df, GEO_COLUMNS, lazy=True)
+    returns such lean frame.]
 
     Args:
         df (pd.DataFrame): [DataFrame containing data about accidents in CR since 2016]
+        columns (tuple, optional): [Kept columns besides coordinates d and e, None for all]. Defaults to None.
+        lazy (bool, optional): [When True plain DataFrame with new index is returned and point geometry
+            is built only for plotted subsets by to_geo]. Defaults to False.
 
     Returns:
-        geopandas.GeoDataFrame: [Data from DataFrame converted into GeoDataFrame]
+        geopandas.GeoDataFrame: [Data from DataFrame converted into GeoDataFrame, DataFrame when lazy is True]
     """
-    #exclude invalid data
-    df = df[df['d'].notna()]
-    df = df[df['e'].notna()]
-    
+    #exclude invalid data with one mask and one copy of only the needed columns
+    mask = (df["d"].notna() & df["e"].notna()).to_numpy()
+    if columns is None:
+        columns = [column for column in df.columns if column not in ("d", "e")]
+        out = df.loc[mask]
+    else:
+        out = df.loc[mask, list(columns)]
+    if lazy:
+        out = out.reset_index(drop=True)
+    out["d"] = np.asarray(df["d"], dtype=float)[mask]
+    out["e"] = np.asarray(df["e"], dtype=float)[mask]
+    out.attrs.update(df.attrs)
+    out.attrs["geo_columns"] = tuple(columns)
+    #rows without coordinates are dropped, so memoized aggregates get fingerprint other than the source data
+    fingerprint = memo.fingerprint_of(df)
+    if fingerprint is not None:
+        memo.bind(out, repr((fingerprint, "geo", tuple(columns))))
+    
+    if lazy:
+        return out
+    return to_geo(out)
+
+def to_geo(df: pd.DataFrame) -> geopandas.GeoDataFrame:
+    """[Converts DataFrame with coordinates d and e into GeoDataFrame]
+
+    Args:
+        df (pd.DataFrame): [Data from make_geo or its subset]
+
+    Returns:
+        geopandas.GeoDataFrame: [Data with point geometry, unchanged when it already is GeoDataFrame]
+    """
+    if isinstance(df, geopandas.GeoDataFrame):
+        return df
     #convert DataFrame to GeoDataFrame, set Coordinate Reference System
     gdf = geopandas.GeoDataFrame(
-        df, geometry=geopandas.points_from_xy(df.d, df.e), crs="EPSG:5514")
-    
+        df, geometry=geopandas.points_from_xy(df["d"].to_numpy(), df["e"].to_numpy()), crs=CRS)
+    gdf.attrs.update(df.attrs)
+    fingerprint = memo.fingerprint_of(df)
+    if fingerprint is not None:
+        memo.bind(gdf, repr((fingerprint, "to_geo")))
     return gdf
 
-def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
+def plot_geo(gdf: pd.DataFrame, fig_location: str = None,
              show_figure: bool = False):
     """[Plots graphs showing accidents in region Vysocina that happened in and outside cities]
 
     Args:
-        gdf (geopandas.GeoDataFrame): [Data of car accidents in Czech Republic since the year 2016]
+        gdf (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016 from make_geo]
         fig_location (str, optional): [Saves graphs as image file]. Defaults to None.
         show_figure (bool, optional): [When True plots graphs on screen]. Defaults to False.
     """ 
@@ -44,27 +91,28 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     ax1,ax2 = axes
     
     #plot data only from desired region and accidents inside cities
-    gdf[ (gdf["region"] == "VYS") & (gdf["p5a"] == 1)].plot(ax=ax1,markersize= 0.3)
+    to_geo(gdf[ (gdf["region"] == "VYS") & (gdf["p5a"] == 1)]).plot(ax=ax1,markersize= 0.3)
     ax1.axis('off')
     ax1.set_title("Nehody v kraji Vysočina: v obci")
     
     #add background map
-    ctx.add_basemap(ax1, crs=gdf.crs.to_string(), source=ctx.providers.Stamen.TonerLite,
+    tiles.add_basemap(ax1, crs=CRS, source=tiles.basemap_source(),
     alpha=0.9)
     
     
     #plot data only from desired region and accidents outside cities
-    gdf[ (gdf["region"] == "VYS") & (gdf["p5a"] == 2)].plot(ax=ax2,markersize= 0.3)
+    to_geo(gdf[ (gdf["region"] == "VYS") & (gdf["p5a"] == 2)]).plot(ax=ax2,markersize= 0.3)
     ax2.set_title("Nehody v kraji Vysočina: mimo obec")
     ax2.axis('off')
     
     #add background map
-    ctx.add_basemap(ax2, crs=gdf.crs.to_string(), source=ctx.providers.Stamen.TonerLite,
+    tiles.add_basemap(ax2, crs=CRS, source=tiles.basemap_source(),
     alpha=0.9)
     
     #When not None saves graph into chosen folder
     if fig_location is not None:
-        plt.savefig(fig_location)
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
     #If show_figure flag is True plots data into window
     if show_figure:
         plt.show()
@@ -72,36 +120,100 @@ def plot_geo(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 
 
 
-def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
-                 show_figure: bool = False):
+def cluster_points(x: np.ndarray, y: np.ndarray, method: str = "kmeans", n_clusters: int = 25,
+                   cell_size: float = 2000.0, batch_size: int = 4096):
+    """[Clusters points given by plain coordinate arrays]
+
+    Args:
+        x (np.ndarray): [X coordinates of points]
+        y (np.ndarray): [Y coordinates of points]
+        method (str, optional): ["kmeans" for full KMeans, "minibatch" for MiniBatchKMeans fed in batches,
+            "grid" for linear time density hotspots in square cells]. Defaults to "kmeans".
+        n_clusters (int, optional): [Count of clusters, for "grid" count of densest cells returned, None for all]. Defaults to 25.
+        cell_size (float, optional): [Size of grid cell in units of coordinates, only for "grid"]. Defaults to 2000.0.
+        batch_size (int, optional): [Count of points in one batch, only for "minibatch"]. Defaults to 4096.
+
+    Returns:
+        tuple: [Array of cluster centroids with shape (clusters, 2) and array of point counts in every cluster]
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if method == "grid":
+        #every point falls into one cell, hotspot centroid is mean of points in the cell
+        cells = np.floor(x / cell_size).astype(np.int64) * (1 << 32) + np.floor(y / cell_size).astype(np.int64)
+        _, inverse, count = np.unique(cells, return_inverse=True, return_counts=True)
+        clusters = np.column_stack((np.bincount(inverse, weights=x) / count, np.bincount(inverse, weights=y) / count))
+        order = np.argsort(count, kind="stable")[::-1][:n_clusters]
+        return clusters[order], count[order]
+
+    X = np.column_stack((x, y))
+    if method == "minibatch":
+        #points are fed in batches, so the model never works with the whole set at once
+        kmeans = sklearn.cluster.MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=1, n_init=3)
+        for start in range(0, len(X), batch_size):
+            kmeans.partial_fit(X[start:start + batch_size])
+        labels = np.concatenate([kmeans.predict(X[start:start + batch_size]) for start in range(0, len(X), batch_size)])
+    elif method == "kmeans":
+        kmeans = sklearn.cluster.KMeans(n_clusters=n_clusters, random_state=1).fit(X)
+        labels = kmeans.labels_
+    else:
+        raise ValueError("unknown clustering method: {}".format(method))
+    return kmeans.cluster_centers_, np.bincount(labels, minlength=n_clusters)
+
+@instrument.traced("cluster_centroids")
+@memo.memoize(version=1)
+def cluster_centroids(df: pd.DataFrame, regions: tuple = ("VYS",), n_clusters: int = 25, method: str = "kmeans",
+                      cell_size: float = 2000.0):
+    """[Clusters accidents of regions using coordinates from columns d and e]
+
+    Args:
+        df (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016, DataFrame or GeoDataFrame]
+        regions (tuple, optional): [Regions to cluster, None for whole country]. Defaults to ("VYS",).
+        n_clusters (int, optional): [Count of clusters]. Defaults to 25.
+        method (str, optional): [Clustering method, see cluster_points]. Defaults to "kmeans".
+        cell_size (float, optional): [Size of grid cell for "grid" method]. Defaults to 2000.0.
+
+    Returns:
+        tuple: [Array of cluster centroids and array of accident counts in every cluster]
+    """
+    #coordinates are taken straight from columns, no geometry objects are touched
+    mask = df["d"].notna().to_numpy() & df["e"].notna().to_numpy()
+    if regions is not None:
+        mask &= df["region"].isin(regions).to_numpy()
+    return cluster_points(np.asarray(df["d"], dtype=float)[mask], np.asarray(df["e"], dtype=float)[mask],
+                          method, n_clusters, cell_size)
+
+def plot_cluster(gdf: pd.DataFrame, fig_location: str = None,
+                 show_figure: bool = False, regions: tuple = ("VYS",), method: str = "kmeans",
+                 n_clusters: int = 25):
     """[Plots graphs showing clustered accidents in Vysocina region]
 
     Args:
-        gdf (geopandas.GeoDataFrame): [Data of car accidents in Czech Republic since the year 2016]
+        gdf (pd.DataFrame): [Data of car accidents in Czech Republic since the year 2016 from make_geo]
         fig_location (str, optional): [Saves graphs as image file]. Defaults to None.
         show_figure (bool, optional): [When True plots graphs on screen]. Defaults to False.
+        regions (tuple, optional): [Plotted regions, None for whole country]. Defaults to ("VYS",).
+        method (str, optional): [Clustering method, see cluster_points]. Defaults to "kmeans".
+        n_clusters (int, optional): [Count of clusters]. Defaults to 25.
     """ 
     
     #create plot
     
     fig, ax = plt.subplots(1, 1, figsize=(16, 12))
     
+    #calculate clusters, save centroids of clusters and count of accidents in every cluster
+    clusters, count = cluster_centroids(gdf, regions, n_clusters, method)
+    
     #separate data only from desired region
-    gdf = gdf[(gdf["region"] == "VYS")]
+    if regions is not None:
+        gdf = gdf[gdf["region"].isin(regions)]
     #plot accidents and hide axis
-    gdf.plot(ax=ax,markersize= 0.3,alpha=0.6)
+    to_geo(gdf).plot(ax=ax,markersize= 0.3,alpha=0.6)
     ax.axis('off')
-    ax.set_title("Nehody v kraji Vysočina:")
-    
-    #calculate clusters
-    X = np.array([[i.x,i.y]for i in gdf.geometry])
-    kmeans = sklearn.cluster.KMeans(n_clusters=25, random_state=1).fit(X)
-    
-    #save count of accidents in every cluster
-    count = np.bincount(kmeans.labels_)
-    
-    #save centroids of clusters
-    clusters = kmeans.cluster_centers_
+    if regions == ("VYS",):
+        ax.set_title("Nehody v kraji Vysočina:")
+    else:
+        ax.set_title("Nehody v krajích: {}".format(", ".join(regions) if regions is not None else "celá ČR"))
     
     #load centroid x,y positions and count of accidents in every cluster into DataFrame
     #for easier plotting
@@ -112,12 +224,13 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
     plt.colorbar()
     
     #add background map
-    ctx.add_basemap(ax, crs=gdf.crs.to_string(), source=ctx.providers.Stamen.TonerLite,
+    tiles.add_basemap(ax, crs=CRS, source=tiles.basemap_source(),
     alpha=0.9)
     
     #When not None saves graph into chosen folder
     if fig_location is not None:
-        plt.savefig(fig_location)
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
     #If show_figure flag is True plots data into window
     if show_figure:
         plt.show()
@@ -125,7 +238,9 @@ def plot_cluster(gdf: geopandas.GeoDataFrame, fig_location: str = None,
 
 if __name__ == "__main__":
     # zde muzete delat libovolne modifikace
-    gdf = make_geo(pd.read_pickle("accidents.pkl.gz"))
+    df = pd.read_pickle("accidents.pkl.gz")
+    memo.bind(df, memo.file_fingerprint("accidents.pkl.gz"))
+    gdf = make_geo(df, GEO_COLUMNS, lazy=True)
     plot_geo(gdf, "geo1.png", True)
     plot_cluster(gdf, "geo2.png", True)
 
@@ -1,45 +1,70 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from timeit import default_timer as timer
-from download import DataDownloader
-from collections import defaultdict
+from download import DataDownloader, BATCH_BUDGET
+import instrument
 
-def plot_stat(data_source, fig_location = None, show_figure = False):
+def count_matrix(years, regions, weights = None):
+    #matrix of counts with one row per year and one column per region, rows are summed or weighted by weights,
+    #returns years, regions in order of their first appearance and the matrix
+    yearvalues, yearindex = np.unique(years, return_inverse=True)
+    regionvalues, first, regionindex = np.unique(regions, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    regionindex = np.argsort(order)[regionindex]
+    regionvalues = regionvalues[order]
+
+    counts = np.bincount(yearindex * regionvalues.size + regionindex, weights=weights, minlength=yearvalues.size * regionvalues.size)
+    return yearvalues, regionvalues, counts.astype(np.int64).reshape(yearvalues.size, regionvalues.size)
 
-    data = defaultdict(dict)
-    for i in range(data_source[1][0].size):
+@instrument.traced("count_stat", rows=lambda result: int(result[2].sum()))
+def count_stat(data_source):
+    #count accidents of every year and region in one pass,
+    #returns years, regions and matrix of counts with one row per year and one column per region
+    #data_source is (header, columns) tuple or DataDownloader, whose yearly rollup is read by count_stat_rollup
+    if isinstance(data_source, DataDownloader):
+        return count_stat_rollup(data_source)
+    header, columns = data_source
+    dates = columns[header.index("p2a")]
+    regions = columns[header.index("region")] if "region" in header else columns[64]
 
-        
-        keyA = str(data_source[1][3][i].astype(object).year)
-        keyB = data_source[1][64][i]
-        
-        if (keyA in data) and (keyB in data[keyA]):
-            data[keyA][keyB] += 1
-        else:
-            data[keyA][keyB] = 0
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    return count_matrix(years, regions)
 
-    for kraj in data['2020']:
-        print(data['2020'][kraj])
+def count_stat_stream(downloader, regions = None, memory_budget = BATCH_BUDGET):
+    #same counts as count_stat computed from batches of cache, memory holds one batch only
+    header, columns = downloader.aggregate(["p2a","region"], regions=regions, memory_budget=memory_budget,
+                                           transform={"p2a": lambda dates: dates.astype("datetime64[Y]")})
+    years = columns[0].astype("datetime64[Y]").astype(np.int64) + 1970
+    return count_matrix(years, columns[1], columns[2])
 
+def count_stat_rollup(downloader, regions = None):
+    #same counts as count_stat summed from rollup store, only a few rows per region and year are read
+    header, columns = downloader.rollup(regions=regions, period="Y")
+    years = columns[1].astype(np.int64) + 1970
+    return count_matrix(years, columns[0], columns[2])
+
+def plot_stat(data_source, fig_location = None, show_figure = False):
+
+    years, regions, counts = count_stat(data_source)
 
-    i = 1
     plt.figure(figsize=(10,7))
-    plt.title("Graf počtu dopravných nehôd v ČR, podľa kraju")
-    for year in data:
-        print(data[year].values())
-        plt.subplot(len(data),1,i)
-        plt.spines("top").set_visible(False)
+    plt.suptitle("Graf počtu dopravných nehôd v ČR, podľa kraju")
+    for i, year in enumerate(years):
+        ax = plt.subplot(len(years),1,i + 1)
+        ax.spines["top"].set_visible(False)
         plt.title(str(year))
-        plt.bar(range(len(data[year])), data[year].values(), align='center')
-        plt.xticks(range(len(data[year])), list(data[year].keys()))
-        
-        i += 1
-    
-
-    plt.show()
-
-start = timer()
-d = DataDownloader()
-plot_stat(data_source = d.get_list(), fig_location = None, show_figure = False)
-end = timer()
-print(end - start)
+        plt.bar(range(len(regions)), counts[i], align='center')
+        plt.xticks(range(len(regions)), list(regions))
+
+    if fig_location is not None:
+        with instrument.stage("savefig"):
+            plt.savefig(fig_location)
+    if show_figure:
+        plt.show()
+
+if __name__ == "__main__":
+    start = timer()
+    d = DataDownloader()
+    plot_stat(data_source = d.get_list(columns = ["p2a","region"]), fig_location = None, show_figure = False)
+    end = timer()
+    print(end - start)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import atexit
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import tracemalloc
+from timeit import default_timer as timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#switch of whole instrumentation, file the trace is written to at exit, switch of log line for every stage,
+#names of stages run under cProfile or tracemalloc and folder of stored profiles
+settings = {"enabled": False, "trace": None, "log": False, "profile": (), "tracemalloc": (), "folder": "profiles"}
+
+#finished stages in order of their end
+records = []
+#names of currently running stages of every thread, nested stage is recorded with path of its parents
+_local = threading.local()
+
+logger = logging.getLogger("izv.instrument")
+
+
+def configure(enabled: bool = None, trace: str = None, log: bool = None, profile: tuple = None,
+              tracemalloc: tuple = None, folder: str = None):
+    """[Turns instrumentation on or off and chooses what is recorded]
+
+    Args:
+        enabled (bool, optional): [When False stages cost only one check]. Defaults to None (unchanged).
+        trace (str, optional): [JSON file the trace is written to at exit]. Defaults to None (unchanged).
+        log (bool, optional): [When True every finished stage is logged by izv.instrument logger]. Defaults to None (unchanged).
+        profile (tuple, optional): [Names of stages run under cProfile]. Defaults to None (unchanged).
+        tracemalloc (tuple, optional): [Names of stages with traced peak of allocated memory]. Defaults to None (unchanged).
+        folder (str, optional): [Folder for cProfile statistics]. Defaults to None (unchanged).
+    """
+    for key, value in (("enabled", enabled), ("trace", trace), ("log", log), ("profile", profile),
+                       ("tracemalloc", tracemalloc), ("folder", folder)):
+        if value is not None:
+            settings[key] = value
+    if trace is not None:
+        os.environ.setdefault("IZV_TRACE_OWNER", str(os.getpid()))
+
+
+def peak_rss() -> float:
+    """[Returns peak resident memory of this process so far in MB, None when it can not be measured]"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _NullStage:
+    """[Stage used while instrumentation is off, it does nothing]"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, rows: int = 0, bytes: int = 0):
+        pass
+
+
+_NULL = _NullStage()
+
+
+class Stage:
+    """[Measures one run of a stage, counts of rows and bytes are added while it runs]"""
+
+    def __init__(self, name: str, rows: int = 0, bytes: int = 0):
+        self.name = name
+        self.rows = rows
+        self.bytes = bytes
+
+    def add(self, rows: int = 0, bytes: int = 0):
+        """[Adds processed rows and read bytes to the stage]"""
+        self.rows += rows
+        self.bytes += bytes
+
+    def __enter__(self):
+        self.stack = _local.__dict__.setdefault("stack", [])
+        self.stack.append(self.name)
+        self.path = "/".join(self.stack)
+        self.profiler = cProfile.Profile() if self.name in settings["profile"] else None
+        self.traced = self.name in settings["tracemalloc"] and not tracemalloc.is_tracing()
+        if self.traced:
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+        self.rss = peak_rss()
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = timer()
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.stack.pop()
+        #peak of the whole process only grows, stage gets how much it raised the peak
+        rss = peak_rss()
+        record = {"stage": self.name, "path": self.path, "start": self.start, "seconds": end - self.start,
+                  "rows": self.rows, "bytes": self.bytes, "process_peak_rss_mb": rss,
+                  "peak_rss_growth_mb": rss - self.rss if rss is not None else None, "pid": os.getpid()}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if self.traced:
+            record["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / 1048576
+            tracemalloc.stop()
+        if self.profiler is not None:
+            os.makedirs(settings["folder"], exist_ok=True)
+            record["profile"] = os.path.join(settings["folder"], "{}-{}-{}.prof".format(self.name, os.getpid(), len(records)))
+            self.profiler.dump_stats(record["profile"])
+        records.append(record)
+        if settings["log"]:
+            logger.info(json.dumps(record))
+        return False
+
+
+def stage(name: str, rows: int = 0, bytes: int = 0):
+    """[Returns context manager measuring the stage, it does nothing while instrumentation is off
+
+    Args:
+        name (str): [Name of stage]
+        rows (int, optional): [Count of processed rows known in advance]. Defaults to 0.
+        bytes (int, optional): [Count of read bytes known in advance]. Defaults to 0.
+
+    Returns:
+        Stage: [Stage, more rows and bytes are added to it by its add method]
+    """
+    if not settings["enabled"]:
+        return _NULL
+    return Stage(name, rows, bytes)
+
+
+def traced(name: str, rows=None):
+    """[Measures every call of decorated function as stage
+
+    Args:
+        name (str): [Name of stage]
+        rows (callable, optional): [Returns count of processed rows from result of function,
+            None for length of first argument of function]. Defaults to None.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings["enabled"]:
+                return func(*args, **kwargs)
+            with Stage(name, len(args[0]) if rows is None and args and hasattr(args[0], "__len__") else 0) as current:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    current.add(rows=rows(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def summary() -> dict:
+    """[Sums recorded stages by their path
+
+    Returns:
+        dict: [Count of calls, total time, rows, bytes and rows per second of every stage path]
+    """
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record["path"], {"calls": 0, "seconds": 0.0, "rows": 0, "bytes": 0})
+        total["calls"] += 1
+        total["seconds"] += record["seconds"]
+        total["rows"] += record["rows"]
+        total["bytes"] += record["bytes"]
+    for total in totals.values():
+        total["rows_per_s"] = total["rows"] / total["seconds"] if total["seconds"] > 0 else None
+    return totals
+
+
+def export(filename: str):
+    """[Writes recorded stages and their summary into JSON file
+
+    Args:
+        filename (str): [Name of file]
+    """
+    with open(filename, "w") as f:
+        json.dump({"stages": records, "summary": summary()}, f, indent=2)
+
+
+def _export_at_exit():
+    #worker processes inherit the settings, only the process which started tracing writes the trace
+    if settings["enabled"] and settings["trace"] is not None and os.environ.get("IZV_TRACE_OWNER") == str(os.getpid()):
+        export(settings["trace"])
+
+
+#IZV_TRACE=trace.json turns instrumentation on for whole run and writes the trace at exit,
+#IZV_PROFILE and IZV_TRACEMALLOC hold comma separated names of stages
+if os.environ.get("IZV_TRACE"):
+    configure(enabled=True, trace=os.environ["IZV_TRACE"],
+              profile=tuple(filter(None, os.environ.get("IZV_PROFILE", "").split(","))),
+              tracemalloc=tuple(filter(None, os.environ.get("IZV_TRACEMALLOC", "").split(","))))
+atexit.register(_export_at_exit)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import functools
+import hashlib
+import os
+import pickle
+import weakref
+
+#folder of stored aggregates, maximal number of stored aggregates and switch for whole memoization
+settings = {"folder": "aggregates", "max_entries": 64, "enabled": True}
+
+#frames with trusted fingerprint by their id, pandas copies attrs into every derived frame,
+#so the fingerprint in attrs is trusted only for the frame it was bound to
+_bound = {}
+
+
+def configure(folder: str = None, max_entries: int = None, enabled: bool = None):
+    """[Changes where and how many aggregates are stored]
+
+    Args:
+        folder (str, optional): [Folder for stored aggregates]. Defaults to None (unchanged).
+        max_entries (int, optional): [Maximal count of stored aggregates, least recently used are removed]. Defaults to None (unchanged).
+        enabled (bool, optional): [When False every aggregate is computed again]. Defaults to None (unchanged).
+    """
+    for key, value in (("folder", folder), ("max_entries", max_entries), ("enabled", enabled)):
+        if value is not None:
+            settings[key] = value
+
+
+def file_fingerprint(filename: str, *extra) -> str:
+    """[Returns fingerprint of dataset loaded from file, it changes whenever the file changes]
+
+    Args:
+        filename (str): [File the dataset was loaded from]
+        extra: [Other values the loaded dataset depends on]
+
+    Returns:
+        str: [Fingerprint of dataset]
+    """
+    stat = os.stat(filename)
+    return repr((os.path.abspath(filename), stat.st_size, stat.st_mtime_ns) + extra)
+
+
+def bind(df, fingerprint: str):
+    """[Sets fingerprint of DataFrame, it is used as key of memoized aggregates only for this very frame
+
+    Frames derived from df (filtered rows, selected columns, copies) inherit df.attrs,
+    but their aggregates are always computed.
+
+    Args:
+        df (pd.DataFrame): [Frame holding whole dataset the fingerprint describes]
+        fingerprint (str): [Fingerprint of dataset]
+    """
+    df.attrs["fingerprint"] = fingerprint
+    key = id(df)
+    _bound[key] = (weakref.ref(df, lambda _: _bound.pop(key, None)), len(df))
+
+
+def fingerprint_of(df) -> str:
+    """[Returns fingerprint bound to df by bind, None for frames without their own fingerprint]"""
+    fingerprint = df.attrs.get("fingerprint")
+    if fingerprint is None:
+        return None
+    ref, length = _bound.get(id(df), (None, None))
+    if ref is None or ref() is not df or length != len(df):
+        return None
+    return fingerprint
+
+
+def _evict(folder: str):
+    """[Removes least recently used aggregates above the maximal count]"""
+    entries = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".pkl")]
+    entries.sort(key=os.path.getmtime)
+    for entry in entries[:max(0, len(entries) - settings["max_entries"])]:
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+
+def memoize(version: int):
+    """[Stores result of aggregate function on disk, keyed by dataset fingerprint, version and arguments
+
+    First argument of func has to be DataFrame with fingerprint bound by bind,
+    without it the result is computed every time. Version has to be raised whenever
+    the result of func changes, so aggregates stored by older code are not used.]
+
+    Args:
+        version (int): [Version of aggregate function]
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(df, *args, **kwargs):
+            fingerprint = fingerprint_of(df) if settings["enabled"] else None
+            if fingerprint is None:
+                return func(df, *args, **kwargs)
+
+            key = repr((func.__module__, func.__qualname__, version, fingerprint, args, sorted(kwargs.items())))
+            folder = settings["folder"]
+            filename = os.path.join(folder, hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+            try:
+                with open(filename, "rb") as f:
+                    result = pickle.load(f)
+                #modification time marks when the aggregate was used last
+                os.utime(filename)
+                return result
+            except (OSError, EOFError, pickle.UnpicklingError):
+                pass
+
+            result = func(df, *args, **kwargs)
+            os.makedirs(folder, exist_ok=True)
+            with open(filename + ".tmp", "wb") as f:
+                pickle.dump(result, f)
+            os.replace(filename + ".tmp", filename)
+            _evict(folder)
+            return result
+        return wrapper
+    return decorator
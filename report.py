@@ -0,0 +1,154 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import argparse
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt
+import pandas as pd
+
+import analysis
+import doc
+import geo
+import instrument
+import memo
+import tiles
+
+#file name of every figure, function drawing it and dataset it is drawn from
+FIGURES = {
+    "01_nasledky.png": (analysis.plot_conseq, "df"),
+    "02_priciny.png": (analysis.plot_damage, "df"),
+    "03_stav.png": (analysis.plot_surface, "df"),
+    "fig.png": (doc.doc, "df"),
+    "geo1.png": (geo.plot_geo, "gdf"),
+    "geo2.png": (geo.plot_cluster, "gdf"),
+}
+
+#aggregates of figures with the same arguments the plots use, they are computed once before rendering
+#and stored by memo, so workers only read them
+AGGREGATES = (
+    (analysis.conseq_sums, "df", ()),
+    (analysis.damage_cube, "df", ()),
+    (analysis.surface_cube, "df", ()),
+    (doc.influence_counts, "df", ()),
+    (geo.cluster_centroids, "gdf", (("VYS",), 25, "kmeans")),
+)
+
+#datasets of this process, forked workers inherit them without copying
+_data = {}
+
+
+def load(filename: str) -> dict:
+    """[Reads dataset once and prepares frames for all figures
+
+    Args:
+        filename (str): [File with data of car accidents, accidents.pkl.gz]
+
+    Returns:
+        dict: [Converted DataFrame under "df" and lean geographic frame under "gdf"]
+    """
+    with instrument.stage("read_pickle", bytes=os.path.getsize(filename)) as stage:
+        raw = pd.read_pickle(filename)
+        stage.add(rows=len(raw))
+    #fingerprints are the same as in __main__ blocks of the modules, so memoized aggregates are shared
+    memo.bind(raw, memo.file_fingerprint(filename))
+    gdf = geo.make_geo(raw, geo.GEO_COLUMNS, lazy=True)
+    df = analysis.convert_dataframe(raw)
+    memo.bind(df, memo.file_fingerprint(filename, tuple(analysis.KEEP_COLUMNS)))
+    return {"df": df, "gdf": gdf}
+
+
+def _init(filename: str):
+    #workers started without fork load the dataset themselves
+    if not _data:
+        _data.update(load(filename))
+
+
+def render(name: str, folder: str) -> str:
+    """[Draws one figure into folder, every figure is closed afterwards
+
+    Args:
+        name (str): [File name of figure from FIGURES]
+        folder (str): [Output folder]
+
+    Returns:
+        str: [Path of written figure]
+    """
+    func, dataset = FIGURES[name]
+    path = os.path.join(folder, name)
+    try:
+        with instrument.stage("render:" + name):
+            func(_data[dataset], fig_location=path, show_figure=False)
+    finally:
+        plt.close("all")
+    return path
+
+
+def _render(name: str, folder: str):
+    #errors are returned as text, so one broken figure does not stop the others
+    try:
+        return render(name, folder), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def run(filename: str, folder: str, figures: list = None, workers: int = None) -> dict:
+    """[Renders figures of the report into folder, figures are drawn in parallel
+
+    Args:
+        filename (str): [File with data of car accidents, accidents.pkl.gz]
+        folder (str): [Output folder]
+        figures (list, optional): [File names of rendered figures]. Defaults to all FIGURES.
+        workers (int, optional): [Count of worker processes, 0 draws in this process]. Defaults to one per figure.
+
+    Returns:
+        dict: [Path of every figure, or its error with traceback]
+    """
+    if figures is None:
+        figures = list(FIGURES)
+    if workers is None:
+        workers = min(len(figures), os.cpu_count() or 1)
+    os.makedirs(folder, exist_ok=True)
+    _data.update(load(filename))
+
+    datasets = {FIGURES[name][1] for name in figures}
+    if memo.settings["enabled"]:
+        for func, dataset, args in AGGREGATES:
+            if dataset in datasets:
+                func(_data[dataset], *args)
+
+    if workers <= 1:
+        results = [_render(name, folder) for name in figures]
+    else:
+        #forked workers share loaded data with this process, other start methods load it in initializer
+        context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init,
+                                 initargs=(filename,)) as executor:
+            results = list(executor.map(_render, figures, [folder] * len(figures)))
+
+    report = {}
+    for name, (path, error) in zip(figures, results):
+        report[name] = {"path": path} if error is None else {"error": error}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Renders all figures of the report")
+    parser.add_argument("--input", default="accidents.pkl.gz", help="file with data of car accidents")
+    parser.add_argument("--output", default="report", help="output folder")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, 0 draws in this process")
+    parser.add_argument("--figures", nargs="+", choices=list(FIGURES), default=None, help="rendered figures")
+    parser.add_argument("--offline", action="store_true", help="never download basemap tiles")
+    parser.add_argument("--tiles-seed", default=None, help="folder with pre-seeded basemap tiles")
+    parser.add_argument("--tiles-source", default=None, help="url template of basemap tiles with {z}, {x} and {y}")
+    args = parser.parse_args()
+
+    tiles.configure(offline=args.offline, seed=args.tiles_seed, source=args.tiles_source)
+    report = run(args.input, args.output, args.figures, args.workers)
+    for name, result in report.items():
+        print("{}: {}".format(name, result.get("path") or result["error"]))
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import os
+
+import numpy as np
+
+#version of stored index, indexes stored by other version are built again
+INDEX_VERSION = 2
+
+
+class SpatialIndex:
+    """[Uniform grid over point coordinates, answers bbox, radius and nearest neighbour queries with row indices
+
+    Points are sorted by id of their grid cell, so points of one row of cells with consecutive
+    columns form one contiguous slice and a query reads only slices of cells it overlaps.]
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_size: float = 500.0, rows: np.ndarray = None):
+        """[Builds index over points, points with missing coordinates (NaN or -1) are left out]
+
+        Args:
+            x (np.ndarray): [X coordinates of points, column d in S-JTSK]
+            y (np.ndarray): [Y coordinates of points, column e in S-JTSK]
+            cell_size (float, optional): [Size of grid cell in meters]. Defaults to 500.0.
+            rows (np.ndarray, optional): [Row index of every point, None for positions in x]. Defaults to None.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if rows is None:
+            rows = np.arange(len(x))
+        #cache of DataDownloader marks missing coordinates by -1, pickled data by NaN
+        valid = ~(np.isnan(x) | np.isnan(y) | (x == -1) | (y == -1))
+        x, y, rows = x[valid], y[valid], np.asarray(rows)[valid]
+
+        self.cell_size = float(cell_size)
+        self.origin = np.array([x.min(), y.min()]) if len(x) else np.zeros(2)
+        cx, cy = self._cell(x, y)
+        self.columns = int(cx.max()) + 1 if len(x) else 1
+        cells = cy * self.columns + cx
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.x = x[order]
+        self.y = y[order]
+        self.rows = rows[order]
+
+    def _cell(self, x, y):
+        #grid column and row of coordinates, clipped so queries outside of grid stay valid
+        cx = np.floor((np.asarray(x) - self.origin[0]) / self.cell_size).astype(np.int64)
+        cy = np.floor((np.asarray(y) - self.origin[1]) / self.cell_size).astype(np.int64)
+        return cx, cy
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        #positions of points in cells overlapping the box
+        if not len(self):
+            return np.empty(0, dtype=np.int64)
+        (cx0, cx1), (cy0, cy1) = self._cell([xmin, xmax], [ymin, ymax])
+        cx0, cx1 = max(cx0, 0), min(cx1, self.columns - 1)
+        cy0, cy1 = max(cy0, 0), min(cy1, int(self.cells[-1] // self.columns))
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+        first = np.arange(cy0, cy1 + 1) * self.columns
+        starts = np.searchsorted(self.cells, first + cx0, side="left")
+        ends = np.searchsorted(self.cells, first + cx1, side="right")
+        return np.concatenate([np.arange(start, end) for start, end in zip(starts, ends)])
+
+    def bbox(self, xmin: float, ymin: float, xmax: float, ymax: float) -> np.ndarray:
+        """[Returns rows of points inside of the box, borders included]
+
+        Args:
+            xmin (float): [Minimal x coordinate]
+            ymin (float): [Minimal y coordinate]
+            xmax (float): [Maximal x coordinate]
+            ymax (float): [Maximal y coordinate]
+
+        Returns:
+            np.ndarray: [Row indices of points]
+        """
+        pos = self._candidates(xmin, ymin, xmax, ymax)
+        x, y = self.x[pos], self.y[pos]
+        return self.rows[pos[(x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)]]
+
+    def radius(self, x: float, y: float, r: float) -> np.ndarray:
+        """[Returns rows of points at most r meters far from point, sorted by distance]
+
+        Args:
+            x (float): [X coordinate of centre]
+            y (float): [Y coordinate of centre]
+            r (float): [Radius in meters]
+
+        Returns:
+            np.ndarray: [Row indices of points]
+        """
+        pos = self._candidates(x - r, y - r, x + r, y + r)
+        dist = np.hypot(self.x[pos] - x, self.y[pos] - y)
+        inside = dist <= r
+        pos, dist = pos[inside], dist[inside]
+        return self.rows[pos[np.argsort(dist, kind="stable")]]
+
+    def knn(self, x: float, y: float, k: int = 1) -> np.ndarray:
+        """[Returns rows of k points nearest to point, sorted by distance]
+
+        Args:
+            x (float): [X coordinate of point]
+            y (float): [Y coordinate of point]
+            k (int, optional): [Count of returned points]. Defaults to 1.
+
+        Returns:
+            np.ndarray: [Row indices of points]
+        """
+        k = min(k, len(self))
+        r = self.cell_size
+        extent = np.hypot(*(np.array([self.x.max(), self.y.max()]) - self.origin)) if len(self) else 0.0
+        #radius grows until it holds k points, those are then the k nearest ones
+        while True:
+            pos = self._candidates(x - r, y - r, x + r, y + r)
+            dist = np.hypot(self.x[pos] - x, self.y[pos] - y)
+            inside = dist <= r
+            if inside.sum() >= k or r > extent + np.hypot(x - self.origin[0], y - self.origin[1]):
+                break
+            r *= 2
+        pos, dist = pos[inside], dist[inside]
+        nearest = np.argsort(dist, kind="stable")[:k]
+        return self.rows[pos[nearest]]
+
+    def save(self, filename: str, fingerprint: str = ""):
+        """[Stores index into npz file]
+
+        Args:
+            filename (str): [Name of file]
+            fingerprint (str, optional): [Fingerprint of indexed data, checked by load]. Defaults to "".
+        """
+        np.savez(filename + ".tmp.npz", cells=self.cells, x=self.x, y=self.y, rows=self.rows,
+                 origin=self.origin, cell_size=self.cell_size, columns=self.columns, fingerprint=fingerprint)
+        os.replace(filename + ".tmp.npz", filename)
+
+    @classmethod
+    def load(cls, filename: str, fingerprint: str = None):
+        """[Loads index stored by save
+
+        Args:
+            filename (str): [Name of file]
+            fingerprint (str, optional): [Expected fingerprint of indexed data, None skips the check]. Defaults to None.
+
+        Returns:
+            SpatialIndex: [Loaded index, None when file is missing or fingerprint differs]
+        """
+        try:
+            stored = np.load(filename)
+        except (OSError, ValueError):
+            return None
+        with stored:
+            if fingerprint is not None and str(stored["fingerprint"]) != fingerprint:
+                return None
+            index = cls.__new__(cls)
+            for name in ("cells", "x", "y", "rows", "origin"):
+                setattr(index, name, stored[name])
+            index.cell_size = float(stored["cell_size"])
+            index.columns = int(stored["columns"])
+        return index
+
+
+def load_index(downloader, regions: list = None, cell_size: float = 500.0, workers: int = None) -> SpatialIndex:
+    """[Returns spatial index over coordinates d and e of cached regions, built only when the cache changed
+
+    Row indices refer to rows returned by downloader.get_list(regions). Index is stored in
+    downloader folder next to the downloaded data.
+
+    Args:
+        downloader (DataDownloader): [Downloader whose cache is indexed]
+        regions (list, optional): [Indexed regions, None for every region]. Defaults to None.
+        cell_size (float, optional): [Size of grid cell in meters]. Defaults to 500.0.
+        workers (int, optional): [Count of processes parsing regions missing in cache]. Defaults to None.
+
+    Returns:
+        SpatialIndex: [Spatial index]
+    """
+    #columns are loaded first, so the cache is up to date before its fingerprint is taken
+    _, (x, y) = downloader.get_list(regions, workers, columns=["d", "e"])
+    fingerprint = repr((INDEX_VERSION, downloader.fingerprint(regions), float(cell_size)))
+    filename = os.path.join(downloader.folder, "spatial_{}.npz".format("_".join(regions) if regions else "all"))
+
+    index = SpatialIndex.load(filename, fingerprint)
+    if index is None:
+        index = SpatialIndex(x, y, cell_size)
+        os.makedirs(downloader.folder, exist_ok=True)
+        index.save(filename, fingerprint)
+    return index
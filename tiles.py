@@ -0,0 +1,209 @@
+#!/usr/bin/env python3.8
+# coding=utf-8
+
+import hashlib
+import io
+import os
+import warnings
+
+import contextily as ctx
+import mercantile
+import numpy as np
+import pyproj
+import requests
+from PIL import Image
+
+import instrument
+
+#folder of downloaded tiles, maximal size of the folder in bytes, switch disabling network
+#folder with pre-seeded tiles in {z}/{x}/{y}.png layout searched before the cache and source of basemaps
+settings = {"folder": "tiles", "max_bytes": 512 * 1024 * 1024, "offline": False, "seed": None, "source": None}
+
+#mosaics built in this process, repeated extents of subplots are reused without touching the disk
+_mosaics = {}
+MAX_MOSAICS = 16
+#count of tiles written into the cache by this process, folder is checked for eviction only after writes
+_written = 0
+
+SEED_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def configure(folder: str = None, max_bytes: int = None, offline: bool = None, seed: str = None, source=None):
+    """[Changes where and how many tiles are stored and where they are taken from]
+
+    Args:
+        folder (str, optional): [Folder for downloaded tiles]. Defaults to None (unchanged).
+        max_bytes (int, optional): [Maximal size of stored tiles, least recently used are removed]. Defaults to None (unchanged).
+        offline (bool, optional): [When True tiles are never downloaded, missing tiles stay blank]. Defaults to None (unchanged).
+        seed (str, optional): [Folder with pre-seeded tiles]. Defaults to None (unchanged).
+        source (TileProvider or str, optional): [Provider or url template of basemaps drawn by geo]. Defaults to None (unchanged).
+    """
+    for key, value in (("folder", folder), ("max_bytes", max_bytes), ("offline", offline), ("seed", seed),
+                       ("source", source)):
+        if value is not None:
+            settings[key] = value
+
+
+def basemap_source():
+    """[Returns configured source of basemaps, Stamen Toner Lite by default]"""
+    if settings["source"] is not None:
+        return settings["source"]
+    #newer xyzservices do not have Stamen provider, CartoDB Positron is the nearest light basemap
+    return ctx.providers.Stamen.TonerLite if "Stamen" in ctx.providers else ctx.providers.CartoDB.Positron
+
+
+def _source_url(source, z: int, x: int, y: int) -> str:
+    #source is either xyzservices provider or url template with {z}, {x} and {y}
+    if hasattr(source, "build_url"):
+        return source.build_url(x=x, y=y, z=z)
+    return source.format(x=x, y=y, z=z)
+
+
+def _source_name(source) -> str:
+    #name of folder with tiles of source
+    name = source.name if hasattr(source, "name") else source
+    return hashlib.sha1(name.encode()).hexdigest()[:16]
+
+
+def _evict(folder: str):
+    """[Removes least recently used tiles until the folder fits into maximal size]"""
+    entries = []
+    for root, _, names in os.walk(folder):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= settings["max_bytes"]:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def fetch_tile(source, z: int, x: int, y: int) -> bytes:
+    """[Returns encoded image of tile from seed folder, tile cache or network in this order
+
+    Args:
+        source (TileProvider or str): [Provider of tiles or url template]
+        z (int): [Zoom level]
+        x (int): [Tile column]
+        y (int): [Tile row]
+
+    Returns:
+        bytes: [Encoded image, None when the tile is not available, failed download is also reported by warning]
+    """
+    global _written
+    if settings["seed"] is not None:
+        for extension in SEED_EXTENSIONS:
+            try:
+                with open(os.path.join(settings["seed"], str(z), str(x), str(y) + extension), "rb") as f:
+                    return f.read()
+            except OSError:
+                pass
+
+    filename = os.path.join(settings["folder"], _source_name(source), str(z), str(x), str(y))
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+        #modification time marks when the tile was used last
+        os.utime(filename)
+        return data
+    except OSError:
+        pass
+
+    if settings["offline"]:
+        return None
+    try:
+        with instrument.stage("tile_download") as stage:
+            response = requests.get(_source_url(source, z, x, y), headers={"User-Agent": "izv"}, timeout=10)
+            response.raise_for_status()
+            stage.add(bytes=len(response.content))
+    except requests.RequestException as error:
+        warnings.warn("basemap tile {}/{}/{} could not be downloaded: {}".format(z, x, y, error))
+        return None
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + ".tmp", "wb") as f:
+        f.write(response.content)
+    os.replace(filename + ".tmp", filename)
+    _written += 1
+    return response.content
+
+
+def _zoom(w: float, s: float, e: float, n: float) -> int:
+    #same choice of zoom as contextily makes for auto zoom
+    return int(min(np.ceil(np.log2(360 * 2.0 / (e - w))), np.ceil(np.log2(360 * 2.0 / (n - s)))))
+
+
+def mosaic(source, w: float, s: float, e: float, n: float, zoom="auto"):
+    """[Joins tiles covering bounds into one image
+
+    Args:
+        source (TileProvider or str): [Provider of tiles or url template]
+        w (float): [Western longitude]
+        s (float): [Southern latitude]
+        e (float): [Eastern longitude]
+        n (float): [Northern latitude]
+        zoom (int or str, optional): [Zoom level, "auto" chooses it by size of bounds]. Defaults to "auto".
+
+    Returns:
+        tuple: [RGBA image and its extent (minX, maxX, minY, maxY) in EPSG:3857]
+    """
+    if zoom == "auto":
+        zoom = _zoom(w, s, e, n)
+        if hasattr(source, "get") and source.get("max_zoom") is not None:
+            zoom = min(zoom, source["max_zoom"])
+    tiles = list(mercantile.tiles(w, s, e, n, [zoom]))
+    key = (_source_name(source), zoom, min(t.x for t in tiles), max(t.x for t in tiles),
+           min(t.y for t in tiles), max(t.y for t in tiles))
+    if key in _mosaics:
+        return _mosaics[key]
+
+    _, _, x0, x1, y0, y1 = key
+    written = _written
+    images = {}
+    for tile in tiles:
+        data = fetch_tile(source, tile.z, tile.x, tile.y)
+        if data is not None:
+            images[tile.x, tile.y] = np.asarray(Image.open(io.BytesIO(data)).convert("RGBA"))
+    size = next(iter(images.values())).shape[0] if images else 256
+    #missing tiles stay transparent
+    img = np.zeros(((y1 - y0 + 1) * size, (x1 - x0 + 1) * size, 4), dtype=np.uint8)
+    for (x, y), image in images.items():
+        img[(y - y0) * size:(y - y0 + 1) * size, (x - x0) * size:(x - x0 + 1) * size] = image
+
+    top_left = mercantile.xy_bounds(x0, y0, zoom)
+    bottom_right = mercantile.xy_bounds(x1, y1, zoom)
+    result = img, (top_left.left, bottom_right.right, bottom_right.bottom, top_left.top)
+
+    #mosaic with missing tiles is not reused, so tiles failed to download are requested again next time
+    if len(images) == len(tiles):
+        if len(_mosaics) >= MAX_MOSAICS:
+            _mosaics.pop(next(iter(_mosaics)))
+        _mosaics[key] = result
+    if _written != written:
+        _evict(settings["folder"])
+    return result
+
+
+@instrument.traced("basemap")
+def add_basemap(ax, crs: str, source, zoom="auto", alpha: float = 1.0, interpolation: str = "bilinear"):
+    """[Draws basemap under data of axes like contextily.add_basemap, tiles are taken through the tile cache
+
+    Args:
+        ax (matplotlib.axes.Axes): [Axes with plotted data]
+        crs (str): [Coordinate reference system of axes]
+        source (TileProvider or str): [Provider of tiles or url template]
+        zoom (int or str, optional): [Zoom level, "auto" chooses it by size of axes extent]. Defaults to "auto".
+        alpha (float, optional): [Transparency of basemap]. Defaults to 1.0.
+        interpolation (str, optional): [Interpolation of image]. Defaults to "bilinear".
+    """
+    xmin, xmax, ymin, ymax = ax.axis()
+    w, s, e, n = pyproj.Transformer.from_crs(crs, "EPSG:4326", always_xy=True).transform_bounds(xmin, ymin, xmax, ymax)
+    img, extent = mosaic(source, w, s, e, n, zoom)
+    #tiles are in web mercator, image is warped into crs of axes
+    img, extent = ctx.warp_tiles(img, extent, t_crs=crs)
+    ax.imshow(img, extent=extent, alpha=alpha, interpolation=interpolation, zorder=0)
+    ax.axis((xmin, xmax, ymin, ymax))